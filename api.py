@@ -0,0 +1,183 @@
+import asyncio
+import logging
+import os
+import random
+import re
+
+import httpx
+
+from metrics import OUTBOUND_ERRORS, OUTBOUND_SECONDS, observe
+from ratelimit import get_limiter, limiter
+from resilience import HEDGED, DeadlineExceeded, breaker, remaining
+
+logger = logging.getLogger(__name__)
+
+URL = os.getenv("API_URL", "https://hermandevescobat-wbx-django-46de.twc1.net/")
+
+# Параметры пула соединений и повторов
+TIMEOUT = httpx.Timeout(float(os.getenv("API_TIMEOUT", "10")), connect=5.0)
+LIMITS = httpx.Limits(
+    max_connections=int(os.getenv("API_MAX_CONNECTIONS", "100")),
+    max_keepalive_connections=int(os.getenv("API_MAX_KEEPALIVE", "20")),
+    keepalive_expiry=30.0,
+)
+RETRIES = int(os.getenv("API_RETRIES", "3"))
+BACKOFF = 0.3
+RETRY_STATUSES = {502, 503, 504}
+# Ограничение нагрузки на бэкенд: всего и на каждый эндпоинт (путь без числовых id)
+API_RPS = float(os.getenv("API_RPS", "100"))
+API_BURST = int(os.getenv("API_BURST", "50"))
+API_ENDPOINT_RPS = float(os.getenv("API_ENDPOINT_RPS", "50"))
+API_ENDPOINT_BURST = int(os.getenv("API_ENDPOINT_BURST", "25"))
+MAX_RETRY_AFTER = 30.0
+# Дублирующий запрос для медленных GET: не раньше этой задержки и не раньше p95 зависимости
+HEDGE_DELAY = float(os.getenv("API_HEDGE_DELAY", "0.3"))
+HEDGE_MIN_SAMPLES = 100
+
+limiter("django_api", API_RPS, API_BURST, API_ENDPOINT_RPS, API_ENDPOINT_BURST)
+
+_client: httpx.AsyncClient | None = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """Общий клиент на весь процесс: пул соединений и keep-alive переиспользуются всеми обработчиками."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(base_url=URL, timeout=TIMEOUT, limits=LIMITS)
+    return _client
+
+
+async def close() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def _endpoint(url: str) -> str:
+    return re.sub(r'/\d+(?=/|$)', '', httpx.URL(url).path)
+
+
+def _retry_after(response: httpx.Response) -> float | None:
+    try:
+        return min(MAX_RETRY_AFTER, float(response.headers["Retry-After"]))
+    except (KeyError, ValueError):
+        return None
+
+
+async def _send(client: httpx.AsyncClient, method: str, url: str, dependency: str, hedge_after: float | None,
+                **kwargs) -> httpx.Response:
+    """Отправляет запрос; если ответа нет дольше hedge_after, параллельно отправляет копию.
+
+    Берётся первый успешный ответ, второй запрос отменяется.
+    """
+    if hedge_after is None:
+        return await client.request(method, url, **kwargs)
+    tasks = {asyncio.create_task(client.request(method, url, **kwargs))}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+        if not done:
+            HEDGED.inc(dependency)
+            tasks.add(asyncio.create_task(client.request(method, url, **kwargs)))
+        error = None
+        while tasks:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def _hedge_delay(dependency: str) -> float:
+    # Копия уходит, когда запрос дольше обычного p95 зависимости, но не раньше HEDGE_DELAY
+    p95 = OUTBOUND_SECONDS.quantile(0.95, dependency, min_count=HEDGE_MIN_SAMPLES)
+    return HEDGE_DELAY if p95 is None else max(HEDGE_DELAY, p95)
+
+
+async def request(method: str, url: str, *, timeout: float | None = None, dependency: str = "django_api",
+                  hedge: bool = False, **kwargs) -> httpx.Response:
+    """Запрос с повторами и экспоненциальной задержкой.
+
+    GET повторяется при сетевых ошибках и 502/503/504, остальные методы — только если
+    соединение не было установлено, чтобы не создать запись на бэкенде дважды.
+    429 повторяется для всех методов с паузой из Retry-After: запрос не был обработан.
+    Каждая попытка ждёт ограничителя зависимости, если он задан, и попадает в метрики
+    под именем dependency.
+
+    Запрос проходит через размыкатель цепи зависимости и укладывается в срок
+    resilience.deadline, если он задан; hedge=True разрешает дублирующий запрос для GET.
+    """
+    client = get_client()
+    idempotent = method.upper() == "GET"
+    bucket = get_limiter(dependency)
+    circuit = breaker(dependency)
+    endpoint = _endpoint(url)
+    if timeout is not None:
+        kwargs['timeout'] = timeout
+    attempt = 0
+    while True:
+        attempt += 1
+        delay = error = None
+        circuit.allow()
+        try:
+            if bucket is not None:
+                try:
+                    async with asyncio.timeout(remaining()):
+                        await bucket.acquire(endpoint)
+                except TimeoutError:
+                    raise DeadlineExceeded(f"Истёк срок ожидания очереди к {dependency}") from None
+            try:
+                with observe(dependency):
+                    async with asyncio.timeout(remaining()):
+                        response = await _send(client, method, url, dependency,
+                                               _hedge_delay(dependency) if hedge and idempotent else None, **kwargs)
+            except TimeoutError:
+                # Истёк срок вызывающего, а не таймаут самой зависимости: очередь и прошлые вызовы
+                # могли съесть почти весь срок, и здоровый бэкенд не должен размыкать цепь.
+                # Свой таймаут httpx приходит как TransportError и считается ниже
+                raise DeadlineExceeded(f"Истёк срок ожидания ответа от {url}") from None
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+                circuit.failure()
+                if attempt > RETRIES:
+                    raise
+                error = e
+                logger.warning("Нет соединения с %s (попытка %s): %s", url, attempt, e)
+            except httpx.TransportError as e:
+                circuit.failure()
+                if not idempotent or attempt > RETRIES:
+                    raise
+                error = e
+                logger.warning("Ошибка запроса %s (попытка %s): %s", url, attempt, e)
+            else:
+                if response.status_code >= 500:
+                    OUTBOUND_ERRORS.inc(dependency)
+                    circuit.failure()
+                else:
+                    circuit.success()
+                if response.status_code == 429 and attempt <= RETRIES:
+                    delay = _retry_after(response)
+                elif not (idempotent and response.status_code in RETRY_STATUSES and attempt <= RETRIES):
+                    return response
+                logger.warning("Ответ %s от %s (попытка %s)", response.status_code, url, attempt)
+        finally:
+            circuit.release()
+        pause = delay if delay is not None else BACKOFF * 2 ** (attempt - 1) * (0.5 + random.random())
+        left = remaining()
+        if left is not None and left <= pause:
+            # Повтор не успеет до срока: отдаём то, что есть
+            if error is not None:
+                raise error
+            return response
+        await asyncio.sleep(pause)
+
+
+async def get(url: str, **kwargs) -> httpx.Response:
+    return await request("GET", url, **kwargs)
+
+
+async def put(url: str, **kwargs) -> httpx.Response:
+    return await request("PUT", url, **kwargs)
@@ -0,0 +1,190 @@
+"""Локальные заглушки внешних сервисов для нагрузочного теста.
+
+Django API, геокодер, S3 и Telegram Bot API (вместе с файловым сервером)
+поднимаются одним aiohttp-приложением на свободном порту. Задержка каждого
+сервиса настраивается отдельно. Bot API может изображать flood control:
+сверх flood_limit сообщений в секунду отвечает 429 с retry_after.
+"""
+import asyncio
+import itertools
+from collections import deque
+import random
+import time
+from dataclasses import dataclass, field
+from io import BytesIO
+
+from aiohttp import web
+from PIL import Image
+
+# Пользователи с id от этого значения считаются незарегистрированными (api/user/{id}/ → 404)
+UNREGISTERED_FROM = 10_000_000
+
+CATEGORIES = [
+    {'id': 1, 'name': 'Одежда', 'parent': None},
+    {'id': 2, 'name': 'Электроника', 'parent': None},
+    {'id': 11, 'name': 'Куртки', 'parent': 1},
+    {'id': 12, 'name': 'Обувь', 'parent': 1},
+    {'id': 21, 'name': 'Телефоны', 'parent': 2},
+    {'id': 22, 'name': 'Ноутбуки', 'parent': 2},
+]
+
+
+@dataclass
+class Latency:
+    """Задержка ответа в секундах: base плюс равномерный разброс до jitter.
+
+    С вероятностью tail_rate к ней добавляется tail — так изображается деградация сервиса.
+    """
+    base: float = 0.0
+    jitter: float = 0.0
+    tail: float = 0.0
+    tail_rate: float = 0.0
+
+    async def wait(self):
+        delay = self.base + random.uniform(0, self.jitter)
+        if self.tail_rate and random.random() < self.tail_rate:
+            delay += self.tail
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+@dataclass
+class FakeServices:
+    api: Latency = field(default_factory=Latency)
+    geocoder: Latency = field(default_factory=Latency)
+    s3: Latency = field(default_factory=Latency)
+    telegram: Latency = field(default_factory=Latency)
+    files: Latency = field(default_factory=Latency)
+    photo_size: tuple = (1280, 960)
+    flood_limit: float = 0.0
+    requests: dict = field(default_factory=dict)
+    objects: dict = field(default_factory=dict)
+
+    def __post_init__(self):
+        self._message_ids = itertools.count(1)
+        self._sent = deque()
+        self._photos = []
+        for color in ((200, 40, 40), (40, 200, 40), (40, 40, 200), (200, 200, 40), (40, 200, 200)):
+            output = BytesIO()
+            Image.new('RGB', self.photo_size, color).save(output, format='JPEG', quality=90)
+            self._photos.append(output.getvalue())
+
+    def _count(self, name):
+        self.requests[name] = self.requests.get(name, 0) + 1
+
+    # Django API
+    async def user(self, request):
+        self._count('api_user')
+        await self.api.wait()
+        user_id = int(request.match_info['user_id'])
+        if user_id >= UNREGISTERED_FROM:
+            return web.json_response({'detail': 'Not found.'}, status=404)
+        return web.json_response({
+            'id_tlg': user_id, 'blocked': False, 'region': 'Москва', 'address': 'Тверская улица, 1',
+            'working_time_start': '08:00:00', 'working_time_end': '22:00:00',
+        })
+
+    async def category(self, request):
+        self._count('api_category')
+        await self.api.wait()
+        return web.json_response(CATEGORIES)
+
+    async def create(self, request):
+        self._count('api_' + request.match_info['kind'])
+        await request.read()
+        await self.api.wait()
+        return web.json_response({'status': 'created'}, status=201)
+
+    # Геокодер
+    async def geocode(self, request):
+        self._count('geocoder')
+        await self.geocoder.wait()
+        lon, lat = request.query['geocode'].split(',')
+        return web.json_response({'response': {'GeoObjectCollection': {'featureMember': [{'GeoObject': {
+            'name': f'Точка {float(lat):.3f}, {float(lon):.3f}',
+            'metaDataProperty': {'GeocoderMetaData': {'Address': {
+                'country_code': 'RU',
+                'Components': [{'kind': 'country', 'name': 'Россия'}, {'kind': 'locality', 'name': 'Москва'}],
+            }}},
+        }}]}}})
+
+    # S3
+    async def s3_put(self, request):
+        self._count('s3_put')
+        body = await request.read()
+        await self.s3.wait()
+        self.objects[request.path] = len(body)
+        return web.Response(headers={'ETag': f'"{hash(body) & 0xffffffff:x}"'})
+
+    async def s3_delete(self, request):
+        self._count('s3_delete')
+        await self.s3.wait()
+        self.objects.pop(request.path, None)
+        return web.Response(status=204)
+
+    # Telegram Bot API
+    def _flooded(self):
+        now = time.monotonic()
+        while self._sent and now - self._sent[0] > 1.0:
+            self._sent.popleft()
+        if len(self._sent) >= self.flood_limit:
+            return True
+        self._sent.append(now)
+        return False
+
+    async def bot_method(self, request):
+        method = request.match_info['method']
+        self._count('tg_' + method)
+        if request.content_type == 'application/json':
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        await self.telegram.wait()
+        if self.flood_limit and method in ('sendMessage', 'sendSticker') and self._flooded():
+            self._count('tg_429')
+            return web.json_response({'ok': False, 'error_code': 429, 'description': 'Too Many Requests: retry after 1',
+                                      'parameters': {'retry_after': 1}}, status=429)
+        if method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+        elif method == 'getFile':
+            file_id = params['file_id']
+            result = {'file_id': file_id, 'file_unique_id': file_id, 'file_size': len(self._photos[0]),
+                      'file_path': f'photos/{file_id}.jpg'}
+        elif method in ('sendMessage', 'sendSticker', 'editMessageText'):
+            chat_id = int(params.get('chat_id', 0))
+            result = {'message_id': next(self._message_ids), 'date': int(time.time()),
+                      'chat': {'id': chat_id, 'type': 'private'}, 'text': params.get('text', '')}
+        else:
+            result = True
+        return web.json_response({'ok': True, 'result': result})
+
+    async def file(self, request):
+        self._count('tg_file')
+        await self.files.wait()
+        name = request.match_info['path']
+        return web.Response(body=self._photos[hash(name) % len(self._photos)], content_type='image/jpeg')
+
+    def app(self):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_get('/api/user/{user_id}/', self.user)
+        app.router.add_get('/api/category', self.category)
+        app.router.add_put('/api/{kind:create-user|create-lot}/', self.create)
+        app.router.add_get('/geocode/1.x/', self.geocode)
+        app.router.add_post('/bot{token}/{method}', self.bot_method)
+        app.router.add_get('/file/bot{token}/{path:.+}', self.file)
+        app.router.add_put('/s3/{path:.+}', self.s3_put)
+        app.router.add_delete('/s3/{path:.+}', self.s3_delete)
+        return app
+
+    async def start(self, host='127.0.0.1', port=0):
+        """Запускает сервер и возвращает его базовый URL."""
+        self._runner = web.AppRunner(self.app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f'http://{host}:{port}'
+
+    async def stop(self):
+        await self._runner.cleanup()
+
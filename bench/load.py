@@ -0,0 +1,196 @@
+"""Сквозной нагрузочный тест conv_add_lot и conv_reg на локальных заглушках.
+
+Каждый симулированный пользователь проходит диалог целиком; обновления подаются
+прямо в Application.process_update, так что время шага — это полная обработка
+update с походами в заглушки. В конце печатаются p50/p95/p99 по шагам и
+пропускная способность в обновлениях в секунду.
+
+    python -m bench.load --lot-users 1000 --reg-users 500 --concurrency 200 --api-latency 0.02
+"""
+import argparse
+import asyncio
+import importlib
+import itertools
+import logging
+import os
+import random
+import tempfile
+import time
+
+from bench.fakes import UNREGISTERED_FROM, FakeServices, Latency
+
+TOKEN = '123456:bench'
+
+_update_ids = itertools.count(1)
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(q / 100 * len(values)) - 1))
+    return values[index]
+
+
+def _user(user_id):
+    return {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}', 'username': f'user{user_id}'}
+
+
+def _message(user_id, **fields):
+    update_id = next(_update_ids)
+    return {'update_id': update_id, 'message': {
+        'message_id': update_id, 'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'}, 'from': _user(user_id), **fields,
+    }}
+
+
+def command(user_id, name):
+    text = f'/{name}'
+    return _message(user_id, text=text, entities=[{'type': 'bot_command', 'offset': 0, 'length': len(text)}])
+
+
+def text(user_id, value):
+    return _message(user_id, text=value)
+
+
+def photo(user_id, index):
+    file_id = f'{user_id}_{index}'
+    return _message(user_id, photo=[{'file_id': file_id, 'file_unique_id': file_id, 'width': 1280, 'height': 960}])
+
+
+def location(user_id, lat, lon):
+    return _message(user_id, location={'latitude': lat, 'longitude': lon})
+
+
+def callback(user_id, data):
+    update_id = next(_update_ids)
+    return {'update_id': update_id, 'callback_query': {
+        'id': str(update_id), 'from': _user(user_id), 'chat_instance': str(user_id), 'data': data,
+        'message': {'message_id': update_id, 'date': int(time.time()), 'chat': {'id': user_id, 'type': 'private'},
+                    'from': {'id': 1, 'is_bot': True, 'first_name': 'Bench'}, 'text': 'Время работы'},
+    }}
+
+
+def lot_steps(user_id, photos):
+    yield 'lots', command(user_id, 'lots')
+    yield 'name', text(user_id, f'Куртка зимняя №{user_id}')
+    yield 'category', text(user_id, 'Одежда')
+    yield 'subcategory', text(user_id, 'Куртки')
+    yield 'main_photo', photo(user_id, 0)
+    for index in range(1, photos):
+        yield 'additional_photo', photo(user_id, index)
+    if photos < 5:
+        yield 'skip', command(user_id, 'skip')
+    yield 'description', text(user_id, 'Тёплая зимняя куртка, почти не носилась, размер M, без дефектов и пятен.')
+    yield 'price', text(user_id, str(random.randint(100, 99999)))
+
+
+def reg_steps(user_id):
+    yield 'acc', command(user_id, 'acc')
+    # Продавцы часто регистрируются из одних и тех же мест — точки кучкуются
+    spot = random.randrange(20)
+    yield 'location', location(user_id, 55.70 + spot * 0.01 + random.uniform(0, 2e-5), 37.60 + random.uniform(0, 2e-5))
+    yield 'working_time', callback(user_id, 'time_one')
+
+
+async def run_user(application, steps, timings, semaphore, think):
+    from telegram import Update
+    async with semaphore:
+        for step, data in steps:
+            started = time.perf_counter()
+            await application.process_update(Update.de_json(data, application.bot))
+            timings.setdefault(step, []).append(time.perf_counter() - started)
+            if think:
+                await asyncio.sleep(random.uniform(0, think))
+
+
+async def run(args):
+    services = FakeServices(
+        api=Latency(args.api_latency, args.jitter, args.tail, args.tail_rate),
+        geocoder=Latency(args.geocoder_latency, args.jitter, args.tail, args.tail_rate),
+        s3=Latency(args.s3_latency, args.jitter),
+        telegram=Latency(args.telegram_latency, args.jitter),
+        files=Latency(args.file_latency, args.jitter),
+        flood_limit=args.flood_limit,
+    )
+    root = await services.start()
+    state = tempfile.TemporaryDirectory()
+    os.environ.update({
+        'JOBS_PATH': os.path.join(state.name, 'jobs.sqlite3'),
+        'PHOTO_INDEX_PATH': os.path.join(state.name, 'photo_index.sqlite3'),
+        'API_URL': f'{root}/',
+        'GEOCODER_URL': f'{root}/geocode/1.x/',
+        'GEOCODER_RPS': '0',
+        'S3_ENDPOINT': f'{root}/s3',
+        'BACKET_NAME': 'bench',
+        'ACCESS_KEY': 'bench',
+        'SECRET_ACCESS_KEY': 'bench',
+        'TOKEN': TOKEN,
+        'TG_RATE': str(args.tg_rate),
+    })
+    os.environ.pop('PERSISTENCE', None)
+    # Модули бота читают настройки при импорте, поэтому импорт — после настройки окружения
+    bot = importlib.import_module('main')
+    from telegram.ext import Application
+    logging.getLogger().setLevel(logging.WARNING)
+
+    builder = (Application.builder().token(TOKEN).updater(None)
+               .base_url(f'{root}/bot').base_file_url(f'{root}/file/bot'))
+    application = bot.build_application(builder)
+    timings: dict[str, list[float]] = {}
+    semaphore = asyncio.Semaphore(args.concurrency)
+    async with application:
+        await application.start()
+        await bot.queue.start()
+        users = [run_user(application, lot_steps(user_id, args.photos), timings, semaphore, args.think)
+                 for user_id in range(1, args.lot_users + 1)]
+        users += [run_user(application, reg_steps(UNREGISTERED_FROM + user_id), timings, semaphore, args.think)
+                  for user_id in range(args.reg_users)]
+        random.shuffle(users)
+        started = time.perf_counter()
+        await asyncio.gather(*users)
+        elapsed = time.perf_counter() - started
+        # Лоты создаются фоновыми задачами уже после ответа пользователю
+        await bot.queue.wait_idle()
+        drained = time.perf_counter() - started
+        await application.stop()
+        await bot.post_stop(application)
+    await bot.post_shutdown(application)
+    await services.stop()
+    state.cleanup()
+
+    total = sum(len(values) for values in timings.values())
+    print(f"{'шаг':<18}{'n':>8}{'p50, мс':>11}{'p95, мс':>11}{'p99, мс':>11}")
+    for step, values in timings.items():
+        print(f'{step:<18}{len(values):>8}' + ''.join(
+            f'{percentile(values, q) * 1000:>11.1f}' for q in (50, 95, 99)))
+    print(f'обновлений: {total}, за {elapsed:.2f} с, {total / elapsed:.1f} обновлений/с; '
+          f'очередь лотов разобрана за {drained:.2f} с')
+    print(f'создано лотов: {services.requests.get("api_create-lot", 0)} из {args.lot_users}, '
+          f'регистраций: {services.requests.get("api_create-user", 0)} из {args.reg_users}')
+    print('запросы к заглушкам:', dict(sorted(services.requests.items())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lot-users', type=int, default=200)
+    parser.add_argument('--reg-users', type=int, default=100)
+    parser.add_argument('--photos', type=int, default=3, choices=range(1, 6), help='фото на лот, 1–5')
+    parser.add_argument('--concurrency', type=int, default=100, help='одновременно активных пользователей')
+    parser.add_argument('--think', type=float, default=0.0, help='пауза пользователя между шагами, до N с')
+    parser.add_argument('--api-latency', type=float, default=0.01)
+    parser.add_argument('--geocoder-latency', type=float, default=0.05)
+    parser.add_argument('--s3-latency', type=float, default=0.03)
+    parser.add_argument('--telegram-latency', type=float, default=0.01)
+    parser.add_argument('--file-latency', type=float, default=0.02)
+    parser.add_argument('--jitter', type=float, default=0.005)
+    parser.add_argument('--tail', type=float, default=0.0, help='редкая добавочная задержка API и геокодера, с')
+    parser.add_argument('--tail-rate', type=float, default=0.0, help='доля ответов API и геокодера с задержкой --tail')
+    parser.add_argument('--tg-rate', type=float, default=28, help='лимит бота на сообщения в секунду, 0 — без лимита')
+    parser.add_argument('--flood-limit', type=float, default=0,
+                        help='заглушка Telegram отвечает 429 сверх N сообщений в секунду, 0 — никогда')
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
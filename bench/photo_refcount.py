@@ -0,0 +1,156 @@
+"""Проверка счётчика ссылок на фото в S3 при дублях и отменах.
+
+На локальной заглушке S3 разыгрываются сценарии: отмена загрузки во время сжатия,
+отмена одного из двух ожидающих одну и ту же загрузку, удаление одного из двух
+владельцев общего фото (в том числе после перезапуска), публикация фото в лоте.
+После каждого сценария в S3 должны остаться только нужные объекты, а в памяти —
+только записи с живыми ссылками.
+
+    python -m bench.photo_refcount
+"""
+import asyncio
+import os
+import sys
+import tempfile
+from io import BytesIO
+
+from PIL import Image
+
+from bench.fakes import FakeServices, Latency
+
+BUCKET = 'bench'
+
+
+def make_photo(seed):
+    output = BytesIO()
+    Image.new('RGB', (2400, 1800), (seed * 37 % 256, seed * 73 % 256, seed * 151 % 256)).save(
+        output, format='JPEG', quality=95)
+    return output.getvalue()
+
+
+async def settle(photos):
+    """Ждёт окончания фоновых загрузок и удалений."""
+    for _ in range(100):
+        await asyncio.sleep(0.05)
+        if not photos._inflight and not photos._waiting:
+            break
+    # Удаление из S3 идёт фоновой задачей после загрузки
+    await asyncio.sleep(1.0)
+
+
+async def cancel_during_resize(services, photos):
+    task = asyncio.create_task(photos.store_photo(BUCKET, make_photo(1)))
+    await asyncio.sleep(0.02)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    await settle(photos)
+    return [] if not services.objects and not photos._pending else [
+        f'осталось объектов: {len(services.objects)}, записей: {len(photos._pending)}']
+
+
+async def cancel_one_of_two_waiters(services, photos):
+    content = make_photo(2)
+    first = asyncio.create_task(photos.store_photo(BUCKET, content))
+    second = asyncio.create_task(photos.store_photo(BUCKET, content))
+    await asyncio.sleep(0.02)
+    first.cancel()
+    renditions = await second
+    await settle(photos)
+    errors = []
+    if renditions is None or len(services.objects) != len(renditions):
+        errors.append(f'после отмены первого объектов: {len(services.objects)}')
+    if [entry[1] for entry in photos._pending.values()] != [1]:
+        errors.append(f'счётчики после отмены: {[entry[1] for entry in photos._pending.values()]}')
+    if renditions is not None:
+        await photos.delete_photos(BUCKET, [renditions])
+    if services.objects or photos._pending:
+        errors.append(f'после удаления объектов: {len(services.objects)}, записей: {len(photos._pending)}')
+    return errors
+
+
+async def shared_photo_released_by_last_owner(services, photos):
+    content = make_photo(3)
+    first, second = await asyncio.gather(photos.store_photo(BUCKET, content), photos.store_photo(BUCKET, content))
+    errors = []
+    if services.requests.get('s3_put', 0) != len(first):
+        errors.append(f'одно и то же фото загружено {services.requests.get("s3_put", 0)} раз по объектам')
+    await photos.delete_photos(BUCKET, [first])
+    if len(services.objects) != len(second):
+        errors.append(f'после удаления первым владельцем объектов: {len(services.objects)}')
+    await photos.delete_photos(BUCKET, [second])
+    if services.objects or photos._pending:
+        errors.append(f'после удаления вторым объектов: {len(services.objects)}, записей: {len(photos._pending)}')
+    return errors
+
+
+async def shared_photo_after_restart(services, photos):
+    content = make_photo(4)
+    first, second = await asyncio.gather(photos.store_photo(BUCKET, content), photos.store_photo(BUCKET, content))
+    # Перезапуск: счётчики в памяти теряются и восстанавливаются из сохранённых задач
+    photos._pending.clear()
+    photos._hash_by_url.clear()
+    photos._file_hashes.clear()
+    photos.restore_photos([first])
+    photos.restore_photos([second])
+    errors = []
+    await photos.delete_photos(BUCKET, [first])
+    if len(services.objects) != len(second):
+        errors.append(f'после провала первой задачи объектов: {len(services.objects)}')
+    await photos.delete_photos(BUCKET, [second])
+    if services.objects or photos._pending:
+        errors.append(f'после провала второй объектов: {len(services.objects)}, записей: {len(photos._pending)}')
+    return errors
+
+
+async def committed_photo_leaves_memory(services, photos):
+    from photo_index import index
+    renditions = await photos.store_photo(BUCKET, make_photo(5), 'unique-5')
+    await photos.commit_photos([renditions])
+    errors = []
+    if photos._pending or photos._file_hashes or photos._hash_by_url:
+        errors.append(f'в памяти осталось: {len(photos._pending)} записей, {len(photos._file_hashes)} file_unique_id')
+    if not index.find_file('unique-5'):
+        errors.append('фото не найдено в индексе по file_unique_id')
+    if len(services.objects) != len(renditions):
+        errors.append(f'объектов после публикации: {len(services.objects)}')
+    return errors
+
+
+SCENARIOS = (cancel_during_resize, cancel_one_of_two_waiters, shared_photo_released_by_last_owner,
+             shared_photo_after_restart, committed_photo_leaves_memory)
+
+
+async def run():
+    services = FakeServices(s3=Latency(0.2))
+    root = await services.start()
+    state = tempfile.TemporaryDirectory()
+    os.environ.update({
+        'S3_ENDPOINT': f'{root}/s3',
+        'ACCESS_KEY': 'bench',
+        'SECRET_ACCESS_KEY': 'bench',
+        'PHOTO_INDEX_PATH': os.path.join(state.name, 'photo_index.sqlite3'),
+    })
+    # Модули читают настройки при импорте
+    import photos
+    from photo_index import index
+    failures = 0
+    try:
+        for scenario in SCENARIOS:
+            services.objects.clear()
+            services.requests.clear()
+            errors = await scenario(services, photos)
+            failures += bool(errors)
+            print(f'{scenario.__name__}: {"; ".join(errors) or "ok"}')
+    finally:
+        index.close()
+        await services.stop()
+        state.cleanup()
+    return failures
+
+
+def main():
+    sys.exit(1 if asyncio.run(run()) else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""Проверка make_renditions под параллельной нагрузкой.
+
+Каждая «заявка» — картинка своего цвета; после одновременной обработки
+каждый результат должен сохранить свой цвет, иначе изображения перепутались.
+
+    python -m bench.resize_stress --submissions 200
+"""
+import argparse
+import asyncio
+import sys
+import time
+from io import BytesIO
+
+from PIL import Image
+
+from photos import _executor, make_renditions
+
+
+def make_image(index):
+    color = (index * 37 % 256, index * 73 % 256, index * 151 % 256)
+    output = BytesIO()
+    Image.new('RGB', (1600, 1200), color).save(output, format='JPEG', quality=95)
+    return color, output.getvalue()
+
+
+def close_enough(a, b, tolerance=6):
+    return all(abs(x - y) <= tolerance for x, y in zip(a, b))
+
+
+async def run(submissions):
+    loop = asyncio.get_running_loop()
+    samples = [make_image(i) for i in range(submissions)]
+    started = time.perf_counter()
+    results = await asyncio.gather(
+        *(loop.run_in_executor(_executor, make_renditions, content) for _, content in samples))
+    elapsed = time.perf_counter() - started
+    failures = 0
+    for index, ((color, _), result) in enumerate(zip(samples, results)):
+        image = Image.open(BytesIO(result['full']))
+        if image.size != (800, 600) or not close_enough(image.getpixel((400, 300)), color):
+            failures += 1
+            print(f'#{index}: ожидался {color}, получено {image.size} {image.getpixel((400, 300))}')
+    print(f'{submissions} изображений за {elapsed:.2f} с, ошибок: {failures}')
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--submissions', type=int, default=100)
+    args = parser.parse_args()
+    sys.exit(1 if asyncio.run(run(args.submissions)) else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""Время запуска и память процесса бота.
+
+Сначала несколько раз в отдельном процессе импортируется main: печатаются время
+импорта, RSS после него и какие тяжёлые модули загрузились сразу. Затем на локальных
+заглушках открываются активные диалоги (лот, остановленный перед ценой, и регистрация,
+остановленная перед выбором времени работы) и печатается прирост памяти на 1000 диалогов
+и средний размер user_data в JSON, как его сохранила бы persistence.
+
+    python -m bench.startup --conversations 2000
+"""
+import argparse
+import asyncio
+import gc
+import importlib
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from bench.fakes import UNREGISTERED_FROM, FakeServices
+from bench.load import TOKEN, lot_steps, reg_steps
+
+HEAVY_MODULES = ('boto3', 'botocore', 'PIL', 'asyncpg', 'requests')
+
+_CHILD = '''
+import json, sys, time
+started = time.perf_counter()
+import main
+elapsed = time.perf_counter() - started
+rss = next(int(line.split()[1]) for line in open('/proc/self/status') if line.startswith('VmRSS'))
+print(json.dumps({'seconds': elapsed, 'rss_kb': rss, 'modules': [name for name in %r if name in sys.modules]}))
+'''
+
+
+def rss_kb():
+    with open('/proc/self/status') as status:
+        return next(int(line.split()[1]) for line in status if line.startswith('VmRSS'))
+
+
+def measure_import(runs):
+    env = dict(os.environ, TOKEN=TOKEN)
+    results = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', _CHILD % (HEAVY_MODULES,)], env=env, check=True,
+                                capture_output=True, text=True, cwd=os.path.dirname(os.path.dirname(__file__)))
+        results.append(json.loads(output.stdout.strip().splitlines()[-1]))
+    print(f"импорт main: медиана {statistics.median(r['seconds'] for r in results) * 1000:.0f} мс "
+          f"из {runs} запусков, RSS {statistics.median(r['rss_kb'] for r in results) / 1024:.1f} МБ")
+    print(f"тяжёлые модули сразу после импорта: {', '.join(results[0]['modules']) or 'нет'}")
+
+
+async def open_conversations(application, count, first_user):
+    """Проводит count пользователей по диалогам, оставляя их незавершёнными."""
+    from telegram import Update
+    semaphore = asyncio.Semaphore(50)
+
+    async def run(steps):
+        async with semaphore:
+            for _, data in steps:
+                await application.process_update(Update.de_json(data, application.bot))
+
+    users = []
+    for offset in range(count):
+        user_id = first_user + offset
+        if offset % 2:
+            users.append(run(list(reg_steps(UNREGISTERED_FROM + user_id))[:-1]))
+        else:
+            users.append(run(list(lot_steps(user_id, 2))[:-1]))
+    await asyncio.gather(*users)
+
+
+async def measure_conversations(count):
+    services = FakeServices()
+    root = await services.start()
+    state = tempfile.TemporaryDirectory()
+    os.environ.update({
+        'API_URL': f'{root}/',
+        'GEOCODER_URL': f'{root}/geocode/1.x/',
+        'GEOCODER_RPS': '0',
+        'S3_ENDPOINT': f'{root}/s3',
+        'BACKET_NAME': 'bench',
+        'ACCESS_KEY': 'bench',
+        'SECRET_ACCESS_KEY': 'bench',
+        'TOKEN': TOKEN,
+        'TG_RATE': '0',
+        'TG_CHAT_RATE': '0',
+        'API_RPS': '0',
+        'API_ENDPOINT_RPS': '0',
+        'JOBS_PATH': os.path.join(state.name, 'jobs.sqlite3'),
+        'PHOTO_INDEX_PATH': os.path.join(state.name, 'photo_index.sqlite3'),
+    })
+    os.environ.pop('PERSISTENCE', None)
+    bot = importlib.import_module('main')
+    from telegram.ext import Application
+    logging.getLogger().setLevel(logging.WARNING)
+
+    builder = (Application.builder().token(TOKEN).updater(None)
+               .base_url(f'{root}/bot').base_file_url(f'{root}/file/bot'))
+    application = bot.build_application(builder)
+    async with application:
+        await application.start()
+        # Прогрев: первые диалоги загружают ленивые модули и заполняют кэши
+        await open_conversations(application, 20, 1)
+        await asyncio.sleep(0.5)
+        gc.collect()
+        rss_before = rss_kb()
+        started = time.perf_counter()
+        await open_conversations(application, count, 1000)
+        elapsed = time.perf_counter() - started
+        # Дожидаемся фоновой обработки фото, чтобы считать только то, что остаётся в памяти
+        await asyncio.sleep(1.0)
+        gc.collect()
+        rss_after = rss_kb()
+        # tracemalloc сам занимает память, поэтому кучу Python меряем на второй партии диалогов
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        await open_conversations(application, count, 1000 + count)
+        await asyncio.sleep(1.0)
+        gc.collect()
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        user_data = [json.dumps(data, ensure_ascii=False) for user_id, data in application.user_data.items()
+                     if user_id >= 1000]
+        await application.stop()
+    await bot.post_shutdown(application)
+    await services.stop()
+    state.cleanup()
+
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    per_thousand = 1000 / count
+    print(f'активных диалогов: {count} за {elapsed:.1f} с')
+    print(f'память Python на 1000 диалогов: {allocated * per_thousand / 1024 / 1024:.2f} МБ, '
+          f'RSS: {(rss_after - rss_before) * per_thousand / 1024:.2f} МБ')
+    print(f'user_data в JSON: в среднем {statistics.mean(map(len, user_data)):.0f} байт, '
+          f'максимум {max(map(len, user_data))} байт')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='запусков для замера импорта')
+    parser.add_argument('--conversations', type=int, default=1000)
+    args = parser.parse_args()
+    measure_import(args.runs)
+    asyncio.run(measure_conversations(args.conversations))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+import asyncio
+import logging
+import os
+import time
+
+from telegram import KeyboardButton, ReplyKeyboardMarkup
+from telegram.ext import ContextTypes
+
+import api
+from resilience import background
+
+logger = logging.getLogger(__name__)
+
+CATEGORY_TTL = int(os.getenv("CATEGORY_TTL", "300"))
+BACK = 'Назад'
+
+
+class CategoryCache:
+    """Дерево категорий на весь процесс с индексами по id и по родителю и готовыми клавиатурами.
+
+    Обновляется фоновой задачей; обработчики читают его без запросов к API.
+    Если данные устарели, отдаются старые, а обновление запускается в фоне.
+    """
+
+    def __init__(self, ttl: int = CATEGORY_TTL):
+        self.ttl = ttl
+        self._loaded_at = 0.0
+        self._lock = asyncio.Lock()
+        self._refresh_task: asyncio.Task | None = None
+        self._by_id: dict[int, dict] = {}
+        self._roots_by_name: dict[str, int] = {}
+        self._children_by_name: dict[int, dict[str, int]] = {}
+        self._root_keyboard: ReplyKeyboardMarkup | None = None
+        self._child_keyboards: dict[int, ReplyKeyboardMarkup] = {}
+
+    @property
+    def loaded(self) -> bool:
+        return self._root_keyboard is not None
+
+    @property
+    def stale(self) -> bool:
+        return time.monotonic() - self._loaded_at > self.ttl
+
+    def _build(self, data: list[dict]) -> None:
+        by_id = {cat['id']: cat for cat in data}
+        roots_by_name = {}
+        children_by_name: dict[int, dict[str, int]] = {}
+        for cat in data:
+            parent = cat.get('parent')
+            if parent is None:
+                roots_by_name[str(cat['name'])] = cat['id']
+            else:
+                children_by_name.setdefault(parent, {})[str(cat['name'])] = cat['id']
+        root_keyboard = ReplyKeyboardMarkup([[KeyboardButton(name)] for name in roots_by_name], one_time_keyboard=True)
+        child_keyboards = {
+            parent: ReplyKeyboardMarkup(
+                [[KeyboardButton(name)] for name in children_by_name.get(parent, {})] + [[KeyboardButton(BACK)]],
+                one_time_keyboard=True)
+            for parent in roots_by_name.values()
+        }
+        # Подменяем все индексы разом, чтобы обработчики не увидели смесь старого и нового дерева
+        (self._by_id, self._roots_by_name, self._children_by_name,
+         self._root_keyboard, self._child_keyboards) = by_id, roots_by_name, children_by_name, root_keyboard, child_keyboards
+        self._loaded_at = time.monotonic()
+
+    async def _load(self) -> None:
+        response = await api.get("api/category", hedge=True)
+        response.raise_for_status()
+        self._build(response.json())
+        logger.info("Категории обновлены: %s", len(self._by_id))
+
+    async def refresh(self) -> None:
+        async with self._lock:
+            await self._load()
+
+    async def _refresh_quietly(self) -> None:
+        try:
+            await self.refresh()
+        except Exception as e:
+            logger.warning("Не удалось обновить категории: %s", e)
+
+    async def ensure(self) -> None:
+        """Первая загрузка ждёт ответа API; дальше устаревшие данные обновляются в фоне."""
+        if not self.loaded:
+            async with self._lock:
+                # Пока ждали блокировку, первую загрузку мог выполнить другой обработчик
+                if not self.loaded:
+                    await self._load()
+        elif self.stale and (self._refresh_task is None or self._refresh_task.done()):
+            self._refresh_task = background(self._refresh_quietly())
+
+    def get(self, category_id: int) -> dict | None:
+        return self._by_id.get(category_id)
+
+    def find_root(self, name: str) -> int | None:
+        return self._roots_by_name.get(name)
+
+    def find_child(self, parent_id: int, name: str) -> int | None:
+        return self._children_by_name.get(parent_id, {}).get(name)
+
+    @property
+    def root_keyboard(self) -> ReplyKeyboardMarkup:
+        return self._root_keyboard
+
+    def child_keyboard(self, parent_id: int) -> ReplyKeyboardMarkup:
+        return self._child_keyboards[parent_id]
+
+
+categories = CategoryCache()
+
+
+# noinspection PyUnusedLocal
+async def refresh_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    await categories._refresh_quietly()
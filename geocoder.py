@@ -0,0 +1,145 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import api
+from ratelimit import limiter
+from resilience import background, wait_shared
+
+logger = logging.getLogger(__name__)
+
+GEOCODER_URL = os.getenv("GEOCODER_URL", "https://geocode-maps.yandex.ru/1.x/")
+GEOCODER_KEY = os.getenv("GEOCODER_KEY", "7d06e3c4-bb49-4906-a47f-65ab042a620b")
+GEOCODER_TIMEOUT = float(os.getenv("GEOCODER_TIMEOUT", "5"))
+GEOCODER_RPS = float(os.getenv("GEOCODER_RPS", "10"))
+# 4 знака после запятой — сетка примерно 10 м: торговый центр или рынок попадает в одну ячейку
+GEOCODE_PRECISION = int(os.getenv("GEOCODE_PRECISION", "4"))
+GEOCODE_CACHE_SIZE = int(os.getenv("GEOCODE_CACHE_SIZE", "50000"))
+GEOCODE_CACHE_PATH = os.getenv("GEOCODE_CACHE_PATH")
+
+
+class GeocodeCache:
+    """Ограниченный LRU кэш ответов геокодера по округлённым координатам.
+
+    Если задан path, записи дублируются в SQLite и переживают перезапуск. База
+    открывается при первом обращении и читается по ключу: в памяти держатся только
+    недавно запрошенные точки.
+    """
+
+    def __init__(self, maxsize: int = GEOCODE_CACHE_SIZE, precision: int = GEOCODE_PRECISION,
+                 path: str | None = GEOCODE_CACHE_PATH):
+        self.maxsize = maxsize
+        self.precision = precision
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, dict] = OrderedDict()
+        self._db: sqlite3.Connection | None = None
+        self._db_lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS geocode (key TEXT PRIMARY KEY, data TEXT NOT NULL, updated REAL NOT NULL)")
+        return self._db
+
+    def key(self, lat: float, lon: float) -> str:
+        return f"{lat:.{self.precision}f},{lon:.{self.precision}f}"
+
+    def get(self, key: str) -> dict | None:
+        """Запись из памяти; промахом считается только поход в геокодер."""
+        data = self._entries.get(key)
+        if data is None:
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return data
+
+    def load(self, key: str) -> dict | None:
+        """Запись из SQLite с переносом в память; блокирующая, вызывается из потока."""
+        if not self.path:
+            return None
+        with self._db_lock:
+            row = self._connect().execute("SELECT data FROM geocode WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        data = json.loads(row[0])
+        self.put(key, data)
+        self.hits += 1
+        return data
+
+    def put(self, key: str, data: dict) -> None:
+        self._entries[key] = data
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def persist(self, key: str, data: dict) -> None:
+        """Запись в SQLite; блокирующая, вызывается из потока."""
+        if not self.path:
+            return
+        with self._db_lock:
+            db = self._connect()
+            db.execute("INSERT OR REPLACE INTO geocode (key, data, updated) VALUES (?, ?, ?)",
+                       (key, json.dumps(data, ensure_ascii=False), time.time()))
+            db.commit()
+
+    def close(self) -> None:
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+            self._db = None
+
+
+class Geocoder:
+    """Асинхронный клиент обратного геокодирования с кэшем, таймаутом и ограничением частоты запросов."""
+
+    def __init__(self, url: str = GEOCODER_URL, apikey: str = GEOCODER_KEY, cache: GeocodeCache | None = None,
+                 rps: float = GEOCODER_RPS, timeout: float = GEOCODER_TIMEOUT):
+        self.url = url
+        self.apikey = apikey
+        self.cache = cache if cache is not None else GeocodeCache()
+        self.timeout = timeout
+        # Запросы к геокодеру проходят через этот ограничитель внутри api.request
+        self.limiter = limiter('geocoder', rps)
+        self._inflight: dict[str, asyncio.Task] = {}
+
+    async def _fetch(self, key: str, lat: float, lon: float) -> dict:
+        try:
+            data = await asyncio.to_thread(self.cache.load, key)
+            if data is not None:
+                return data
+            self.cache.misses += 1
+            response = await api.get(self.url, timeout=self.timeout, dependency='geocoder', hedge=True, params={
+                'apikey': self.apikey,
+                'geocode': f"{lon},{lat}",
+                'results': 1,
+                'format': 'json',
+            })
+            response.raise_for_status()
+            data = response.json()
+            if data['response']['GeoObjectCollection']['featureMember']:
+                self.cache.put(key, data)
+                await asyncio.to_thread(self.cache.persist, key, data)
+            return data
+        finally:
+            self._inflight.pop(key, None)
+
+    async def reverse(self, lat: float, lon: float) -> dict:
+        """Ответ геокодера для точки; соседние точки одной ячейки сетки берутся из кэша."""
+        key = self.cache.key(lat, lon)
+        data = self.cache.get(key)
+        if data is not None:
+            return data
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._inflight[key] = background(self._fetch(key, lat, lon))
+        return await wait_shared(task)
+
+
+geocoder = Geocoder()
@@ -0,0 +1,223 @@
+"""Массовый импорт лотов продавца из CSV или JSON и zip-архива с фото.
+
+    python importer.py lots.csv photos.zip --seller 123456789 --username my_shop
+
+Поля строки: name, category, description, price, photos. category — id подкатегории
+или «Категория/Подкатегория»; photos — имена файлов в архиве через «;» (в JSON можно
+списком), главное фото первым, не больше пяти. Строки проверяются по тем же правилам,
+что и в диалоге /lots; с --dry-run импорт ограничивается проверкой.
+"""
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import os
+import sys
+import time
+import zipfile
+
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import api
+from categories import categories
+from lots import MAX_PHOTOS, lot_data, valid_description, valid_name, valid_price
+from photo_index import index
+from photos import commit_photos, delete_photos, store_photo
+from storage import uploader
+from users import users
+
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+BUCKET_NAME = os.getenv("BACKET_NAME")
+PROGRESS_INTERVAL = 2.0
+
+
+def read_rows(path: str) -> list[dict]:
+    if path.lower().endswith('.json'):
+        with open(path, encoding='utf-8') as file:
+            return json.load(file)
+    with open(path, encoding='utf-8-sig', newline='') as file:
+        return list(csv.DictReader(file))
+
+
+def resolve_category(value) -> int | None:
+    """id подкатегории по её id или по пути «Категория/Подкатегория»."""
+    value = str(value or '').strip()
+    if value.isdigit():
+        category = categories.get(int(value))
+        return category['id'] if category is not None and category.get('parent') is not None else None
+    root, _, child = value.partition('/')
+    parent_id = categories.find_root(root.strip())
+    return categories.find_child(parent_id, child.strip()) if parent_id is not None else None
+
+
+def parse_row(row: dict, archive_names: set[str]) -> tuple[dict | None, list[str]]:
+    """Проверяет строку и возвращает лот для импорта или список ошибок."""
+    errors = []
+    name = str(row.get('name') or '').strip()
+    description = str(row.get('description') or '').strip()
+    price = str(row.get('price') or '').strip()
+    photos = row.get('photos') or []
+    if isinstance(photos, str):
+        photos = [photo.strip() for photo in photos.split(';') if photo.strip()]
+    if not valid_name(name):
+        errors.append('название: от 10 до 80 символов')
+    category_id = resolve_category(row.get('category'))
+    if category_id is None:
+        errors.append(f'подкатегория не найдена: {row.get("category")!r}')
+    if not valid_description(description):
+        errors.append('описание: от 50 до 500 символов')
+    if not valid_price(price):
+        errors.append(f'неверный формат цены: {price!r}')
+    if not 1 <= len(photos) <= MAX_PHOTOS:
+        errors.append(f'фото: от 1 до {MAX_PHOTOS}')
+    missing = [photo for photo in photos if photo not in archive_names]
+    if missing:
+        errors.append(f'нет в архиве: {", ".join(missing)}')
+    if errors:
+        return None, errors
+    return {'name': name, 'category': category_id, 'description': description, 'price': price,
+            'photos': photos}, []
+
+
+class Importer:
+    """Загружает фото и создаёт лоты пулом из concurrency параллельных воркеров.
+
+    Фото одного лота обрабатываются параллельно; общий предел на сжатие и загрузку
+    задают пул потоков photos и S3Uploader, на запросы к бэкенду — ограничитель api.
+    """
+
+    def __init__(self, archive: zipfile.ZipFile, seller: int, url_chat: str, concurrency: int):
+        self.archive = archive
+        self.seller = seller
+        self.url_chat = url_chat
+        self.concurrency = concurrency
+        self.created = 0
+        self.failed: list[tuple[int, str]] = []
+        self.total = 0
+
+    async def _upload_photo(self, name: str):
+        content = await asyncio.to_thread(self.archive.read, name)
+        return await store_photo(BUCKET_NAME, content)
+
+    async def _import_lot(self, lot: dict) -> str | None:
+        """Создаёт лот; возвращает текст ошибки или None."""
+        results = await asyncio.gather(*(self._upload_photo(name) for name in lot['photos']),
+                                       return_exceptions=True)
+        photos = [result for result in results if isinstance(result, dict)]
+        if len(photos) < len(results):
+            await delete_photos(BUCKET_NAME, photos)
+            return 'не удалось обработать фото'
+        data = lot_data(self.seller, lot['name'], [lot['category']], photos, self.url_chat,
+                        lot['description'], lot['price'])
+        try:
+            response = await api.put("api/create-lot/", headers={"Content-Type": "application/json"}, json=data)
+        except httpx.HTTPError as e:
+            await delete_photos(BUCKET_NAME, photos)
+            return f'ошибка запроса: {e}'
+        if response.status_code != 201:
+            await delete_photos(BUCKET_NAME, photos)
+            return f'api/create-lot/ ответил {response.status_code}: {response.text[:200]}'
+        await commit_photos(photos)
+
+    async def _worker(self, lots: asyncio.Queue) -> None:
+        while not lots.empty():
+            number, lot = lots.get_nowait()
+            try:
+                error = await self._import_lot(lot)
+            except Exception as e:
+                # Непредвиденная ошибка одного лота не должна останавливать импорт остальных
+                logger.exception("Ошибка импорта строки %s", number)
+                error = f'непредвиденная ошибка: {e!r}'
+            if error is None:
+                self.created += 1
+            else:
+                self.failed.append((number, error))
+
+    async def _report_progress(self, started: float) -> None:
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            self.print_progress(started)
+
+    def print_progress(self, started: float) -> None:
+        done = self.created + len(self.failed)
+        elapsed = time.monotonic() - started
+        print(f'{done}/{self.total}: создано {self.created}, ошибок {len(self.failed)}, '
+              f'{done / elapsed if elapsed else 0:.1f} лотов/с', file=sys.stderr)
+
+    async def run(self, lots: list[tuple[int, dict]]) -> None:
+        self.total = len(lots)
+        queue = asyncio.Queue()
+        for item in lots:
+            queue.put_nowait(item)
+        started = time.monotonic()
+        progress = asyncio.create_task(self._report_progress(started))
+        try:
+            await asyncio.gather(*(self._worker(queue) for _ in range(min(self.concurrency, len(lots)))))
+        finally:
+            progress.cancel()
+        self.print_progress(started)
+
+
+async def run(args) -> int:
+    rows = read_rows(args.lots)
+    archive = zipfile.ZipFile(args.photos)
+    try:
+        try:
+            data = await users.get(args.seller)
+            await categories.ensure()
+        except (httpx.HTTPError, ValueError) as e:
+            print(f'Не удалось получить данные бэкенда: {e}', file=sys.stderr)
+            return 1
+        if data is None or data['blocked']:
+            print(f'Продавец {args.seller} не зарегистрирован или заблокирован', file=sys.stderr)
+            return 1
+        archive_names = set(archive.namelist())
+        lots, invalid = [], []
+        # Номера строк как в файле: в CSV первая строка — заголовок
+        first = 1 if args.lots.lower().endswith('.json') else 2
+        for number, row in enumerate(rows, first):
+            lot, errors = parse_row(row, archive_names)
+            if lot is None:
+                invalid.append((number, '; '.join(errors)))
+            else:
+                lots.append((number, lot))
+        print(f'Строк: {len(rows)}, к импорту: {len(lots)}, с ошибками: {len(invalid)}', file=sys.stderr)
+        for number, error in invalid:
+            print(f'  строка {number}: {error}', file=sys.stderr)
+        if args.dry_run or not lots:
+            return 1 if invalid else 0
+
+        await uploader.start()
+        importer = Importer(archive, args.seller, f"https://t.me/{args.username.lstrip('@')}", args.concurrency)
+        await importer.run(lots)
+        for number, error in sorted(importer.failed):
+            print(f'  строка {number}: {error}', file=sys.stderr)
+        return 1 if invalid or importer.failed else 0
+    finally:
+        archive.close()
+        await api.close()
+        index.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('lots', help='CSV или JSON с лотами')
+    parser.add_argument('photos', help='zip-архив с фото')
+    parser.add_argument('--seller', type=int, required=True, help='Telegram id продавца')
+    parser.add_argument('--username', required=True, help='@username продавца для ссылки на чат')
+    parser.add_argument('--concurrency', type=int, default=int(os.getenv("IMPORT_CONCURRENCY", "16")),
+                        help='лотов в обработке одновременно')
+    parser.add_argument('--dry-run', action='store_true', help='только проверить файл')
+    sys.exit(asyncio.run(run(parser.parse_args())))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+JOBS_PATH = os.getenv("JOBS_PATH", "jobs.sqlite3")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "8"))
+JOB_BACKOFF = float(os.getenv("JOB_BACKOFF", "5"))
+JOB_MAX_BACKOFF = float(os.getenv("JOB_MAX_BACKOFF", "600"))
+POLL_INTERVAL = 1.0
+
+
+class PermanentError(Exception):
+    """Повтор не поможет: задача сразу считается проваленной."""
+
+
+class Job:
+    def __init__(self, queue: 'DurableQueue', job_id: int, kind: str, payload: dict, attempts: int):
+        self.queue = queue
+        self.id = job_id
+        self.kind = kind
+        self.payload = payload
+        self.attempts = attempts
+
+    async def save(self) -> None:
+        """Сохраняет изменённый payload, чтобы повтор не делал уже сделанную работу."""
+        await asyncio.to_thread(self.queue._execute, "UPDATE jobs SET payload = ?, updated = ? WHERE id = ?",
+                                (json.dumps(self.payload, ensure_ascii=False), time.time(), self.id))
+
+
+class DurableQueue:
+    """Очередь фоновых задач в SQLite с пулом асинхронных воркеров.
+
+    Задачи переживают перезапуск: незавершённые при остановке возвращаются в очередь.
+    Ошибка обработчика ведёт к повтору с экспоненциальной задержкой, PermanentError или
+    исчерпание попыток — к вызову on_failure.
+    """
+
+    def __init__(self, path: str = JOBS_PATH, workers: int = JOB_WORKERS, max_attempts: int = JOB_MAX_ATTEMPTS):
+        self.path = path
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self._handlers = {}
+        self._failure_handlers = {}
+        self._db: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+        self._wakeup: asyncio.Event | None = None
+        self._tasks: list[asyncio.Task] = []
+        self._running = 0
+
+    def register(self, kind: str, handler, on_failure=None) -> None:
+        self._handlers[kind] = handler
+        if on_failure is not None:
+            self._failure_handlers[kind] = on_failure
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.executescript(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, payload TEXT NOT NULL,"
+                " status TEXT NOT NULL DEFAULT 'pending', attempts INTEGER NOT NULL DEFAULT 0,"
+                " next_run REAL NOT NULL, last_error TEXT, created REAL NOT NULL, updated REAL NOT NULL);"
+                "CREATE INDEX IF NOT EXISTS jobs_due ON jobs (status, next_run);"
+            )
+        return self._db
+
+    def _execute(self, sql: str, params=()) -> sqlite3.Cursor:
+        with self._lock:
+            db = self._connect()
+            with db:
+                return db.execute(sql, params)
+
+    def _claim(self) -> tuple | None:
+        with self._lock:
+            db = self._connect()
+            with db:
+                row = db.execute(
+                    "SELECT id, kind, payload, attempts FROM jobs WHERE status = 'pending' AND next_run <= ? "
+                    "ORDER BY next_run LIMIT 1", (time.time(),)).fetchone()
+                if row is not None:
+                    db.execute("UPDATE jobs SET status = 'running', attempts = attempts + 1, updated = ? WHERE id = ?",
+                               (time.time(), row[0]))
+                return row
+
+    def _next_due(self) -> float | None:
+        with self._lock:
+            row = self._connect().execute("SELECT MIN(next_run) FROM jobs WHERE status = 'pending'").fetchone()
+        return row[0]
+
+    async def enqueue(self, kind: str, payload: dict) -> int:
+        now = time.time()
+        cursor = await asyncio.to_thread(
+            self._execute,
+            "INSERT INTO jobs (kind, payload, next_run, created, updated) VALUES (?, ?, ?, ?, ?)",
+            (kind, json.dumps(payload, ensure_ascii=False), now, now, now))
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return cursor.lastrowid
+
+    async def payloads(self, kind: str) -> list[dict]:
+        """payload незавершённых задач kind, например чтобы восстановить после перезапуска состояние в памяти."""
+        cursor = await asyncio.to_thread(
+            self._execute, "SELECT payload FROM jobs WHERE kind = ? AND status IN ('pending', 'running')", (kind,))
+        return [json.loads(payload) for payload, in cursor.fetchall()]
+
+    async def start(self) -> None:
+        # Задачи, которые выполнялись при прошлой остановке, выполняем заново
+        await asyncio.to_thread(self._execute, "UPDATE jobs SET status = 'pending' WHERE status = 'running'")
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker(index)) for index in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    async def wait_idle(self) -> None:
+        """Ждёт, пока не останется готовых к выполнению и выполняющихся задач."""
+        while True:
+            due = await asyncio.to_thread(self._next_due)
+            if self._running == 0 and (due is None or due > time.time()):
+                return
+            await asyncio.sleep(0.05)
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            row = await asyncio.to_thread(self._claim)
+            if row is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            job_id, kind, payload, attempts = row
+            job = Job(self, job_id, kind, json.loads(payload), attempts + 1)
+            self._running += 1
+            try:
+                await self._run(job)
+            finally:
+                self._running -= 1
+
+    async def _run(self, job: Job) -> None:
+        try:
+            await self._handlers[job.kind](job)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if isinstance(e, PermanentError) or job.attempts >= self.max_attempts:
+                logger.error("Задача %s %s провалена после %s попыток: %s", job.kind, job.id, job.attempts, e)
+                await asyncio.to_thread(self._execute, "UPDATE jobs SET status = 'failed', last_error = ?, updated = ? "
+                                        "WHERE id = ?", (str(e), time.time(), job.id))
+                on_failure = self._failure_handlers.get(job.kind)
+                if on_failure is not None:
+                    try:
+                        await on_failure(job, e)
+                    except Exception as failure_error:
+                        logger.error("Ошибка обработки провала задачи %s: %s", job.id, failure_error)
+                return
+            delay = min(JOB_MAX_BACKOFF, JOB_BACKOFF * 2 ** (job.attempts - 1)) * random.uniform(0.5, 1.5)
+            logger.warning("Задача %s %s: попытка %s не удалась (%s), повтор через %.0f с",
+                           job.kind, job.id, job.attempts, e, delay)
+            await asyncio.to_thread(self._execute, "UPDATE jobs SET status = 'pending', next_run = ?, last_error = ?, "
+                                    "updated = ? WHERE id = ?", (time.time() + delay, str(e), time.time(), job.id))
+        else:
+            await asyncio.to_thread(self._execute, "UPDATE jobs SET status = 'done', updated = ? WHERE id = ?",
+                                    (time.time(), job.id))
+
+
+queue = DurableQueue()
@@ -0,0 +1,31 @@
+NAME_LENGTH = (10, 80)
+DESCRIPTION_LENGTH = (50, 500)
+PRICE_DIGITS = 10
+MAX_PHOTOS = 5
+
+
+def valid_name(name: str) -> bool:
+    return NAME_LENGTH[0] <= len(name) <= NAME_LENGTH[1]
+
+
+def valid_description(description: str) -> bool:
+    return DESCRIPTION_LENGTH[0] <= len(description) <= DESCRIPTION_LENGTH[1]
+
+
+def valid_price(price: str) -> bool:
+    return price.isdigit() and 1 <= len(price) <= PRICE_DIGITS
+
+
+def lot_data(id_tlg: int, name: str, category_ids: list[int], photos: list[dict], url_chat: str,
+             description: str, price: str) -> dict:
+    """Тело запроса api/create-lot/; photos — список {размер: URL} в порядке показа."""
+    return {
+        "id_tlg": id_tlg,
+        "name": name,
+        "categories": category_ids,
+        "url_photos": [photo['full'] for photo in photos],
+        "photo_renditions": photos,
+        "url_chat": url_chat,
+        "description": description,
+        "price": price,
+    }
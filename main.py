@@ -1,20 +1,37 @@
+import asyncio
+import functools
 import logging
 import os
 import random
 import uuid
-from datetime import datetime
 from warnings import filterwarnings
-import boto3
-import requests
-from PIL import Image
+import httpx
 from dotenv import load_dotenv
-from telegram import Update, ReplyKeyboardRemove, InlineKeyboardButton, InlineKeyboardMarkup, KeyboardButton, ReplyKeyboardMarkup
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ConversationHandler, ContextTypes, MessageHandler, filters
+from telegram import Bot, Update
+from telegram.ext import Application, ApplicationBuilder, CommandHandler, CallbackQueryHandler, ConversationHandler, ContextTypes, MessageHandler, TypeHandler, filters
+from telegram.error import TelegramError
 from telegram.warnings import PTBUserWarning
-from stickers import TADA, GREETING
 
+# .env читается до импорта модулей бота: они берут настройки из окружения при загрузке
 load_dotenv()
 
+import api
+from categories import BACK, CATEGORY_TTL, categories, refresh_job
+from geocoder import geocoder
+from jobs import Job, PermanentError, queue
+from lots import MAX_PHOTOS, lot_data, valid_description, valid_name, valid_price
+from metrics import Gauge, instrument, register, start_server, stop_server
+from persistence import create_persistence
+from photo_index import index
+from ratelimit import TelegramRateLimiter
+from resilience import with_deadline
+from prompts import message, user_locale
+from photos import (collect_photo_uploads, commit_photos, delete_photos, discard_photo_uploads, restore_photos,
+                    start_photo_upload, transfer_photo_uploads)
+from stickers import TADA, GREETING
+from users import users
+from webhook import run_webhook
+
 # Logger
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
@@ -27,7 +44,29 @@ filterwarnings(action="ignore", message=r".*CallbackQueryHandler", category=PTBU
 
 NAME, CATEGORY, SUBCATEGORY, MAIN_PHOTO, ADDITIONAL_PHOTO, DESCRIPTION, PRICE = range(7)
 LOCATION, WORKING_TIME, IS_REG = range(3)
-URL = "https://hermandevescobat-wbx-django-46de.twc1.net/"
+LOT_STATES = {NAME: "NAME", CATEGORY: "CATEGORY", SUBCATEGORY: "SUBCATEGORY", MAIN_PHOTO: "MAIN_PHOTO",
+              ADDITIONAL_PHOTO: "ADDITIONAL_PHOTO", DESCRIPTION: "DESCRIPTION", PRICE: "PRICE"}
+REG_STATES = {LOCATION: "LOCATION", WORKING_TIME: "WORKING_TIME", IS_REG: "IS_REG"}
+BUCKET_NAME = os.getenv("BACKET_NAME")
+LOT_TIMEOUT = int(os.getenv("LOT_TIMEOUT", "1800"))
+REG_TIMEOUT = int(os.getenv("REG_TIMEOUT", "1800"))
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Поля user_data каждого диалога: после завершения они удаляются, чтобы не копились в памяти и в хранилище
+LOT_FIELDS = ('link', 'name', 'category_parent', 'category', 'photo_ids', 'description')
+REG_FIELDS = ('coordinates', 'region', 'address', 'working_time', 'locations')
+
+
+def clear_user_data(context: ContextTypes.DEFAULT_TYPE, fields) -> None:
+    for field in fields:
+        context.user_data.pop(field, None)
+
+# Поля GeoObject, которые уходят в api/create-user/; границы и прочее не храним в user_data
+GEO_OBJECT_FIELDS = ('name', 'description', 'Point', 'metaDataProperty')
+
+
+def slim_geo_object(geo_object):
+    return {field: geo_object[field] for field in GEO_OBJECT_FIELDS if field in geo_object}
+
 
 def get_geo_object_info(data):
     for feature in data['response']['GeoObjectCollection']['featureMember']:
@@ -37,61 +76,8 @@ def get_geo_object_info(data):
         components = address['Components']
         for i in components:
             if i['kind'] == 'locality':
-                return address['country_code'], geo_object['name'], i['name']
-    return None, None, None
-
-
-def resize_image(image_path, output_width, output_height, output_format):
-    try:
-        image = Image.open(image_path)
-        image = image.convert('RGB')
-        image.thumbnail((output_width, output_height))
-        output_path = os.path.splitext(image_path)[0] + '.' + output_format.lower()
-        image.save(output_path, format=output_format)
-        return output_path
-    except Exception as e:
-        logger.info("Ошибка при обработке изображения %s: %s", image_path, e)
-        return None
-
-
-def upload_photos_to_s3(bucket_name, photo_urls, user_id):
-    date_time = datetime.now().strftime("%Y%m%d%H%M%S")
-
-    # Создание клиента S3
-    s3 = boto3.client(
-        's3',
-        endpoint_url='https://s3.timeweb.cloud',
-        aws_access_key_id=os.getenv('ACCESS_KEY'),
-        aws_secret_access_key=os.getenv('SECRET_ACCESS_KEY'),
-    )
-
-    uploaded_files_urls = []
-    try:
-        for photo_url in photo_urls:
-            response = requests.get(photo_url)
-            if response.status_code == 200:
-                photo_content = response.content
-                new_key = f'{uuid.uuid4()}_{user_id}_{date_time}.jpg'
-                temp_image_path = '/tmp/temp_image.jpg'
-                with open(temp_image_path, 'wb') as temp_image:
-                    temp_image.write(photo_content)
-                output_path = resize_image(temp_image_path, output_width=800, output_height=600, output_format='JPEG')
-                if output_path:
-                    try:
-                        s3.upload_file(output_path, bucket_name, new_key)
-                        file_url = f'https://s3.timeweb.cloud/{bucket_name}/{new_key}'
-                        uploaded_files_urls.append(file_url)
-                        logger.info(f'Файл успешно загружен как {new_key} в ведро {bucket_name}')
-                    except Exception as e:
-                        logger.error(f'Ошибка при загрузке файла {output_path} в ведро {bucket_name}/{new_key}: {e}')
-                    os.remove(output_path)
-                else:
-                    logger.error(f'Ошибка при обработке изображения {temp_image_path}')
-            else:
-                logger.error(f'Ошибка при загрузке изображения с URL {photo_url}')
-    except Exception as e:
-        logger.error(f'Произошла ошибка: {e}')
-    return uploaded_files_urls
+                return address['country_code'], geo_object['name'], i['name'], geo_object
+    return None, None, None, None
 
 
 # Функции start
@@ -100,10 +86,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user = update.message.from_user
     logger.info("User %s started the conversation.", user.first_name)
     await update.message.reply_sticker(random.choice(GREETING))
-    await update.message.reply_text(
-        f"Привет, {user.first_name}! Добро пожаловать на площадку объявлений WBX. "
-        f"Нажмите на кнопку 'Пуск' в левом нижнем углу, чтобы познакомиться с объявлениями!",
-    )
+    await update.message.reply_text(**message('start', user_locale(update), first_name=user.first_name))
 
 
 # Функции add_lot
@@ -111,232 +94,213 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 async def lot_add_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user_id = update.message.from_user.id
     link = update.message.from_user.link
-    url = f"{URL}api/user/{user_id}/"
-    response = requests.get(url)
-    data = response.json()
-    if data['blocked']:
+    locale = user_locale(update)
+    try:
+        data = await users.get(user_id)
+    except (httpx.HTTPError, ValueError) as e:
+        logger.warning("Не удалось получить пользователя %s: %s", user_id, e)
+        await update.message.reply_text(**message('unavailable', locale))
+        return ConversationHandler.END
+    if data is None or data['blocked']:
         return ConversationHandler.END
     else:
         if link is not None:
             context.user_data['link'] = link
-            await update.message.reply_text(
-                "🔎 *Название*\n\n"
-                f"Отменить заполнение, нажмите /cancel",
-                parse_mode='MarkdownV2'
-            )
+            await update.message.reply_text(**message('lot.name', locale))
             return NAME
         else:
-            await update.message.reply_text(
-                "У вас нет @username(ссылки), что бы открывать чат с вами. Зайдите \"Настройки\", \"Имя пользователя\", придумайте имя пользователя, после установки это сообщение больше не появится.",
-            )
+            await update.message.reply_text(**message('lot.no_username', locale))
             return ConversationHandler.END
 
 
 async def lot_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    url = f"{URL}api/category"
     name = update.message.text
-    if 10 <= len(name) <= 80:
+    locale = user_locale(update)
+    if valid_name(name):
         context.user_data['name'] = name
         try:
-            response = requests.get(url)
-            response.raise_for_status()
-            context.user_data['category_data'] = response.json()
-            filtered_data = [cat for cat in context.user_data['category_data'] if cat.get('parent') is None]
-            context.user_data['filtered_data'] = filtered_data
-            keyboard = [[KeyboardButton(str(cat['name']))] for cat in context.user_data['filtered_data']]
-            await update.message.reply_text(
-                "📕 *Категория*\n\n"
-                "Отменить заполнение, нажмите /cancel",
-                reply_markup=ReplyKeyboardMarkup(keyboard, one_time_keyboard=True),
-                parse_mode='MarkdownV2')
+            await categories.ensure()
+            await update.message.reply_text(**message('lot.category', locale), reply_markup=categories.root_keyboard)
             return CATEGORY
-        except requests.RequestException:
-            await update.message.reply_text(
-                f"Ошибка при запросе к API. Повторите попытку.\n\n"
-                f"Отменить заполнение, нажмите /cancel")
+        except httpx.HTTPError:
+            await update.message.reply_text(**message('lot.api_error', locale))
             return NAME
     else:
-        await update.message.reply_text(
-            f"Неверный формат. Ввод от 10 до 80 символов. Повторите ввод.\n\n"
-            f"Отменить заполнение, нажмите /cancel")
+        await update.message.reply_text(**message('lot.name_invalid', locale))
         return NAME
 
 
 async def lot_category(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    category = update.message.text
-    for cat in context.user_data['filtered_data']:
-        if cat['name'] == category:
-            filtered_data = [subcat for subcat in context.user_data['category_data'] if subcat.get('parent') == cat.get('id')]
-            context.user_data['filtered_data_subcategory'] = filtered_data
-            keyboard = [[KeyboardButton(str(sub_cat['name']))] for sub_cat in filtered_data]
-            keyboard.append([KeyboardButton('Назад')])
-            await update.message.reply_text(
-                "📗 *Подкатегория*\n\n"
-                "Отменить заполнение, нажмите /cancel",
-                reply_markup=ReplyKeyboardMarkup(keyboard, one_time_keyboard=True),
-                parse_mode='MarkdownV2')
-            return SUBCATEGORY
-    await update.message.reply_text("Категория не найдена. Повторите выбор.")
+    parent_id = categories.find_root(update.message.text)
+    locale = user_locale(update)
+    if parent_id is not None:
+        context.user_data['category_parent'] = parent_id
+        await update.message.reply_text(**message('lot.subcategory', locale),
+                                        reply_markup=categories.child_keyboard(parent_id))
+        return SUBCATEGORY
+    await update.message.reply_text(**message('lot.category_not_found', locale))
     return CATEGORY
 
 
 async def lot_subcategory(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     subcategory = update.message.text
-    if subcategory == 'Назад':
-        keyboard = [[KeyboardButton(str(cat['name']))] for cat in context.user_data['filtered_data']]
-        await update.message.reply_text(
-            "📕 *Категория*\n\n"
-            "Отменить заполнение, нажмите /cancel",
-            reply_markup=ReplyKeyboardMarkup(keyboard, one_time_keyboard=True),
-            parse_mode='MarkdownV2')
+    locale = user_locale(update)
+    if subcategory == BACK:
+        await update.message.reply_text(**message('lot.category', locale), reply_markup=categories.root_keyboard)
         return CATEGORY
     else:
-        found = False
-        for subcat in context.user_data['filtered_data_subcategory']:
-            if subcat['name'] == subcategory:
-                context.user_data['category'] = [subcat.get('id')]
-                logger.info('cat: %s', context.user_data['category'])
-                await update.message.reply_text(
-                    "🖼 *Главное фото*\n\n"
-                    "Отменить заполнение, нажмите /cancel",
-                    reply_markup=ReplyKeyboardRemove(),
-                    parse_mode='MarkdownV2')
-                found = True
-                break
-        if not found:
-            await update.message.reply_text("Подкатегория не найдена. Повторите выбор.")
+        category_id = categories.find_child(context.user_data['category_parent'], subcategory)
+        if category_id is None:
+            await update.message.reply_text(**message('lot.subcategory_not_found', locale))
             return SUBCATEGORY
+        context.user_data['category'] = [category_id]
+        logger.info('cat: %s', context.user_data['category'])
+        await update.message.reply_text(**message('lot.main_photo', locale))
         return MAIN_PHOTO
 
 
 async def lot_main_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    photo_file = await update.message.photo[-1].get_file()
-    logger.info('photo_file: %s: ', photo_file)
-    url_photo_main = photo_file.file_path
-    logger.info('Url photo: %s: ', url_photo_main)
-    context.user_data['url_photos'] = [url_photo_main]
-    await update.message.reply_text(
-        "🖼 <b>Дополнительные фото (4 шт)</b>\n"
-        "Пропустить добавление фото и перейти к описанию, нажмите /skip\n"
-        "Отменить заполнение, нажмите /cancel",
-        parse_mode='HTML')
+    # Храним file_id, а не ссылку на файл: в ней токен бота, а user_data попадает в хранилище
+    photo = update.message.photo[-1]
+    logger.info('photo: %s', photo.file_id)
+    await discard_photo_uploads(BUCKET_NAME, update.message.from_user.id)
+    start_photo_upload(context.bot, BUCKET_NAME, photo.file_id, update.message.from_user.id, photo.file_unique_id)
+    context.user_data['photo_ids'] = [photo.file_id]
+    await update.message.reply_text(**message('lot.additional_photos', user_locale(update)))
     return ADDITIONAL_PHOTO
 
 
 async def lot_additional_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    photo_file = await update.message.photo[-1].get_file()
-    context.user_data['url_photos'].append(photo_file.file_path)
-    if len(context.user_data['url_photos']) < 5:
+    photo = update.message.photo[-1]
+    start_photo_upload(context.bot, BUCKET_NAME, photo.file_id, update.message.from_user.id, photo.file_unique_id)
+    context.user_data['photo_ids'].append(photo.file_id)
+    locale = user_locale(update)
+    if len(context.user_data['photo_ids']) < MAX_PHOTOS:
         await update.message.reply_text(
-            f"🖼 *Еще {5 - len(context.user_data['url_photos'])} допфото*\n\n"
-            "Пропустить добавление фото, нажмите /skip\n\n"
-            "Отменить заполнение, нажмите /cancel",
-            parse_mode='MarkdownV2')
+            **message('lot.more_photos', locale, count=MAX_PHOTOS - len(context.user_data['photo_ids'])))
         return ADDITIONAL_PHOTO
     else:
-        await update.message.reply_text(
-            "📝 *Описание*\n"
-            "Отменить заполнение, нажмите /cancel",
-            parse_mode='MarkdownV2')
+        await update.message.reply_text(**message('lot.description', locale))
         return DESCRIPTION
 
 
 # noinspection PyUnusedLocal
 async def lot_skip_additional_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(
-        "📝 *Описание*\n"
-        "Отменить заполнение, нажмите /cancel",
-        parse_mode='MarkdownV2')
+    await update.message.reply_text(**message('lot.description', user_locale(update)))
     return DESCRIPTION
 
 
 async def lot_description(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user_input = update.message.text
-    if 50 <= len(user_input) <= 500:
+    locale = user_locale(update)
+    if valid_description(user_input):
         context.user_data['description'] = user_input
-        await update.message.reply_text(
-            f"💵 *Стоимость*\n\n"
-            f"Отменить заполнение, нажмите /cancel",
-            parse_mode='MarkdownV2')
+        await update.message.reply_text(**message('lot.price', locale))
         return PRICE
     else:
-        await update.message.reply_text(
-            f"Не верный формат ввода.Формат от 50 до 500 знаков. Повторите ввод.\n\n"
-            f"Отменить заполнение, нажмите /cancel")
+        await update.message.reply_text(**message('lot.description_invalid', locale))
         return DESCRIPTION
 
 
 async def lot_price(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     id_tlg = update.message.from_user.id
     price = update.message.text
-    url_photos = upload_photos_to_s3(os.getenv("BACKET_NAME"), context.user_data['url_photos'], id_tlg)
-    url = f"{URL}api/create-lot/"
-    headers = {
-        "Content-Type": "application/json"
-    }
-
-    if price.isdigit() and 0 <= int(price) and 1 <= len(price) <= 10:
-        data = {
+    locale = user_locale(update)
+
+    if valid_price(price):
+        # Загрузку фото и создание лота доделывает фоновая задача, диалог завершается сразу
+        uploads = f"lot:{uuid.uuid4().hex}"
+        transfer_photo_uploads(id_tlg, uploads)
+        await queue.enqueue("create_lot", {
+            "chat_id": update.effective_chat.id,
+            "locale": locale,
+            "uploads": uploads,
             "id_tlg": id_tlg,
             "name": context.user_data['name'],
             "categories": context.user_data['category'],
-            "url_photos": url_photos,
+            "photo_ids": context.user_data['photo_ids'],
             "url_chat": context.user_data['link'],
             "description": context.user_data['description'],
             "price": price,
-        }
-        try:
-            response = requests.put(url, headers=headers, json=data)
-            logger.info('Responser: %s | %s', response, response.text)
-            if response.status_code == 201:
-                await update.message.reply_sticker(random.choice(TADA))
-                await update.message.reply_text("Ваш лот добавлен!")
-                return ConversationHandler.END
-            else:
-                return ConversationHandler.END
-        except requests.RequestException as e:
-            await update.message.reply_text(
-                f"Request error. Error: {e}")
-            return ConversationHandler.END
+        })
+        clear_user_data(context, LOT_FIELDS)
+        await update.message.reply_text(**message('lot.accepted', locale))
+        return ConversationHandler.END
     else:
-        await update.message.reply_text("Не верный формат цены. Повторите ввод.")
+        await update.message.reply_text(**message('lot.price_invalid', locale))
         return PRICE
 
 
+async def create_lot_job(bot: Bot, job: Job) -> None:
+    payload = job.payload
+    photos = payload.get('photos')
+    if photos is None:
+        # Фото уже загружаются в фоне, ждём только незавершённые
+        photos = await collect_photo_uploads(bot, BUCKET_NAME, payload['photo_ids'], payload['uploads'])
+        if len(photos) < len(payload['photo_ids']):
+            # Лот без части фото не создаём: загруженные освобождаем, повтор загрузит все заново
+            await delete_photos(BUCKET_NAME, photos)
+            raise RuntimeError(f"загружено {len(photos)} из {len(payload['photo_ids'])} фото")
+        # Повторные попытки берут уже загруженные фото
+        payload['photos'] = photos
+        await job.save()
+    if not payload.get('created'):
+        # Ответ мог потеряться после создания лота: по ключу бэкенд узнает повтор того же лота
+        headers = {
+            "Content-Type": "application/json",
+            "Idempotency-Key": payload['uploads'],
+        }
+        data = lot_data(payload['id_tlg'], payload['name'], payload['categories'], photos, payload['url_chat'],
+                        payload['description'], payload['price'])
+        response = await api.put("api/create-lot/", headers=headers, json=data)
+        logger.info('Responser: %s | %s', response, response.text)
+        if response.status_code != 201:
+            if response.is_server_error or response.status_code == 429:
+                response.raise_for_status()
+            raise PermanentError(f"api/create-lot/ ответил {response.status_code}")
+        # Лот создан: повтор после ошибки ниже не должен отправлять его ещё раз
+        payload['created'] = True
+        await job.save()
+    await commit_photos(photos)
+    try:
+        await bot.send_sticker(payload['chat_id'], random.choice(TADA))
+        await bot.send_message(payload['chat_id'], **message('lot.created', payload.get('locale')))
+    except TelegramError as e:
+        logger.warning("Не удалось уведомить пользователя %s о лоте: %s", payload['id_tlg'], e)
+
+
+async def create_lot_failed(bot: Bot, job: Job, error: Exception) -> None:
+    payload = job.payload
+    if payload.get('created'):
+        # Лот уже опубликован, его фото удалять нельзя
+        logger.error("Лот %s создан, но задача %s не завершилась: %s", payload['name'], job.id, error)
+        return
+    if 'photos' in payload:
+        await delete_photos(BUCKET_NAME, payload['photos'])
+    else:
+        await discard_photo_uploads(BUCKET_NAME, payload['uploads'])
+    await bot.send_message(payload['chat_id'], **message('lot.failed', payload.get('locale'), name=payload['name']))
+
+
 async def user_reg(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     id_tlg = update.message.from_user.id
-    url = f"{URL}api/user/{id_tlg}/"
+    locale = user_locale(update)
     try:
-        response = requests.get(url)
-        if response.status_code == 200:
-            data = response.json()
+        data = await users.get(id_tlg)
+        if data is not None:
             if not data['blocked']:
-                keyboard = [
-                    [InlineKeyboardButton("✏️ Редактировать", callback_data="edit_reg")],
-                    [InlineKeyboardButton("🚪 Выход", callback_data="exit_reg")]
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await update.message.reply_text(
-                    f"Регион: {data['region']}\n"
-                    f"Адрес: {data['address']}\n"
-                    f"Время работы: с {data['working_time_start'][:5]} до {data['working_time_end'][:5]} \n",
-                    reply_markup=reply_markup
-                )
+                await update.message.reply_text(**message(
+                    'reg.profile', locale, region=data['region'], address=data['address'],
+                    start=data['working_time_start'][:5], end=data['working_time_end'][:5]))
                 return IS_REG
             else:
                 return ConversationHandler.END
-        elif response.status_code == 404:
-            await update.message.reply_text(
-                "📍 *Геопозиция*\n\n"
-                "Для отмены нажмите /cancel",
-                parse_mode='MarkdownV2'
-            )
-            return LOCATION
         else:
-            response.raise_for_status()
-            return ConversationHandler.END
-    except requests.RequestException:
-        await update.message.reply_text("Ошибка при запросе к API. Повторите попытку.")
+            await update.message.reply_text(**message('reg.location', locale))
+            return LOCATION
+    except (httpx.HTTPError, ValueError) as e:
+        logger.warning("Не удалось получить пользователя %s: %s", id_tlg, e)
+        await update.message.reply_text(**message('reg.api_error', locale))
         return ConversationHandler.END
 
 
@@ -344,42 +308,28 @@ async def user_loc(update: Update, context: ContextTypes.DEFAULT_TYPE):
     coordinates = update.message.location
     lat, lon = coordinates.latitude, coordinates.longitude
     context.user_data['coordinates'] = {"lat": f"{lat}", "lon": f"{lon}"}
-    url = f"https://geocode-maps.yandex.ru/1.x/?apikey=7d06e3c4-bb49-4906-a47f-65ab042a620b&geocode={lon},{lat}&results=1&format=json"
+    locale = user_locale(update)
     try:
-        response = requests.get(url)
-        data = response.json()
-        country_code, address, region = get_geo_object_info(data)
+        data = await geocoder.reverse(lat, lon)
+        country_code, address, region, geo_object = get_geo_object_info(data)
         if country_code == 'RU' and address and region:
             context.user_data['region'] = region
             context.user_data['address'] = address
-            keyboard = [
-                [InlineKeyboardButton("⏱ с 8.00 до 22.00", callback_data="time_one")],
-                [InlineKeyboardButton("⏱ с 10.00 до 21.00", callback_data="time_two")],
-            ]
-            context.user_data['locations'] = data['response']['GeoObjectCollection']['featureMember']
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await update.message.reply_text(
-                "⌛️ *Время работы*\n\n"
-                "Для отмены нажмите /cancel",
-                parse_mode='MarkdownV2',
-                reply_markup=reply_markup)
+            # Полный ответ геокодера не храним, только найденный объект: при отправке геокодер
+            # больше не нужен, и его сбой не сорвёт регистрацию
+            context.user_data['locations'] = [{'GeoObject': slim_geo_object(geo_object)}]
+            await update.message.reply_text(**message('reg.working_time', locale))
             return WORKING_TIME
         else:
-            await update.message.reply_text(
-                "Что то пошло не так. Попробуйте выбрать геометку еще раз.\n\n"
-                "Для отмены нажмите /cancel"
-            )
+            await update.message.reply_text(**message('reg.location_invalid', locale))
             return LOCATION
-    except requests.RequestException as e:
-        await update.message.reply_text(
-            f"Request error. Error: {e}"
-        )
+    except httpx.HTTPError as e:
+        await update.message.reply_text(**message('reg.request_error', locale, error=e))
         return ConversationHandler.END
 
 
 async def user_working_time(update: Update, context: ContextTypes.DEFAULT_TYPE):
     id_tlg = update.callback_query.from_user.id
-    url = f"{URL}api/create-user/"
     headers = {
         "Content-Type": "application/json"
     }
@@ -393,28 +343,51 @@ async def user_working_time(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "working_time_end": context.user_data['working_time'][1],
         "blocked": False
     }
+    locale = user_locale(update)
     try:
-        response = requests.put(url, headers=headers, json=data)
+        response = await api.put("api/create-user/", headers=headers, json=data)
         logger.info("response: %s", response)
+        users.invalidate(id_tlg)
         if response.status_code == 201:
+            clear_user_data(context, REG_FIELDS)
             await update.callback_query.message.reply_sticker(random.choice(TADA))
-            await update.callback_query.message.reply_text("Отлично! Теперь можно добавлять объявления!")
+            await update.callback_query.message.reply_text(**message('reg.done', locale))
             return ConversationHandler.END
 
-    except requests.RequestException as e:
-        await update.message.reply_text(
-            f"Request error. Error: {e}"
-        )
+    except httpx.HTTPError as e:
+        clear_user_data(context, REG_FIELDS)
+        await update.callback_query.message.reply_text(**message('reg.request_error', locale, error=e))
         return ConversationHandler.END
 
 
-# Функция отмены
+# Функции отмены: у каждого диалога своя, чтобы /cancel одного не трогал данные другого
 # noinspection PyUnusedLocal
-async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    await update.message.reply_text("Форма закрыта...", reply_markup=ReplyKeyboardRemove())
+async def cancel_lot(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    await discard_photo_uploads(BUCKET_NAME, update.effective_user.id)
+    clear_user_data(context, LOT_FIELDS)
+    await update.message.reply_text(**message('closed', user_locale(update)))
     return ConversationHandler.END
 
 
+# noinspection PyUnusedLocal
+async def cancel_reg(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    # Фото открытого лота остаются: их отменяет только /cancel самого лота
+    clear_user_data(context, REG_FIELDS)
+    await update.message.reply_text(**message('closed', user_locale(update)))
+    return ConversationHandler.END
+
+
+# noinspection PyUnusedLocal
+async def lot_timeout(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await discard_photo_uploads(BUCKET_NAME, update.effective_user.id)
+    clear_user_data(context, LOT_FIELDS)
+
+
+# noinspection PyUnusedLocal
+async def reg_timeout(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    clear_user_data(context, REG_FIELDS)
+
+
 async def user_edit_exit_reg(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -422,13 +395,13 @@ async def user_edit_exit_reg(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await query.delete_message()
         return ConversationHandler.END
     if query.data == "edit_reg":
-        await query.edit_message_text("Пока не доступно!")
+        await query.edit_message_text(**message('reg.edit_unavailable', user_locale(update)))
         return ConversationHandler.END
 
 
 # Функции обратного вызова
 # noinspection PyUnusedLocal
-async def user_wt_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def user_wt_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     if query.data == "time_one":
@@ -437,46 +410,115 @@ async def user_wt_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         context.user_data['working_time'] = ('10:00:00', '21:00:00')
 
     # Now you can call the working_time function
-    await user_working_time(update, context)
+    return await user_working_time(update, context)
+
+# noinspection PyUnusedLocal
+async def post_init(application: Application) -> None:
+    # Клиент S3 и Pillow загружаются при первой обработке фото, а не при старте
+    await start_server()
+    # Ссылки на фото из задач, переживших перезапуск, восстанавливаем до их выполнения
+    for payload in await queue.payloads("create_lot"):
+        if 'photos' in payload:
+            restore_photos(payload['photos'])
+    await queue.start()
+
+
+# noinspection PyUnusedLocal
+async def post_stop(application: Application) -> None:
+    # Прерванные задачи останутся в очереди и выполнятся после перезапуска
+    await queue.stop()
+
 
-def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+# noinspection PyUnusedLocal
+async def post_shutdown(application: Application) -> None:
+    await stop_server()
+    await api.close()
+    geocoder.cache.close()
+    index.close()
+
+
+async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     logger.error("Exception while handling an update:", exc_info=context.error)
 
-# Главная функция
-def main() -> None:
-    """Run the bot."""
-    # Create the Application and pass it your bot's token.
-    application = Application.builder().token(os.getenv("TOKEN")).build()
+
+def guarded(handler, conversation=None, states=None):
+    """Шаг диалога с метриками и общим сроком на все его запросы к API и геокодеру."""
+    return instrument(with_deadline(handler), conversation, states)
+
+
+def build_application(builder: ApplicationBuilder) -> Application:
+    """Собирает приложение со всеми обработчиками; токен и транспорт задаёт вызывающий."""
+    persistence = create_persistence()
+    if persistence is not None:
+        builder.persistence(persistence)
+    builder.rate_limiter(TelegramRateLimiter())
+    application = builder.build()
     # Subscribe
+    reg = functools.partial(guarded, conversation="conv_reg", states=REG_STATES)
     conv_reg = ConversationHandler(
-        entry_points=[CommandHandler("acc", user_reg)],
+        entry_points=[CommandHandler("acc", reg(user_reg))],
         states={
-            LOCATION: [MessageHandler(filters.LOCATION, user_loc)],
-            WORKING_TIME: [CallbackQueryHandler(user_wt_callback)],
-            IS_REG: [CallbackQueryHandler(user_edit_exit_reg)],
+            LOCATION: [MessageHandler(filters.LOCATION, reg(user_loc))],
+            WORKING_TIME: [CallbackQueryHandler(reg(user_wt_callback))],
+            IS_REG: [CallbackQueryHandler(reg(user_edit_exit_reg))],
+            # Брошенная регистрация считается уходом в метриках и не держит состояние вечно
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, instrument(reg_timeout, "conv_reg"))],
         },
-        fallbacks=[CommandHandler("cancel", cancel)],
+        fallbacks=[CommandHandler("cancel", instrument(cancel_reg, "conv_reg"))],
+        conversation_timeout=REG_TIMEOUT,
+        name="conv_reg",
+        persistent=persistence is not None,
     )
     # Add lot
+    lot = functools.partial(guarded, conversation="conv_add_lot", states=LOT_STATES)
     conv_add_lot = ConversationHandler(
-        entry_points=[CommandHandler("lots", lot_add_start)],
+        entry_points=[CommandHandler("lots", lot(lot_add_start))],
         states={
-            NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, lot_name)],
-            CATEGORY: [MessageHandler(filters.TEXT & ~filters.COMMAND, lot_category)],
-            SUBCATEGORY: [MessageHandler(filters.TEXT & ~filters.COMMAND, lot_subcategory)],
-            MAIN_PHOTO: [MessageHandler(filters.PHOTO, lot_main_photo)],
-            ADDITIONAL_PHOTO: [MessageHandler(filters.PHOTO, lot_additional_photo), CommandHandler("skip", lot_skip_additional_photo)],
-            DESCRIPTION: [MessageHandler(filters.TEXT & ~filters.COMMAND, lot_description)],
-            PRICE: [MessageHandler(filters.TEXT & ~filters.COMMAND, lot_price)],
+            NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, lot(lot_name))],
+            CATEGORY: [MessageHandler(filters.TEXT & ~filters.COMMAND, lot(lot_category))],
+            SUBCATEGORY: [MessageHandler(filters.TEXT & ~filters.COMMAND, lot(lot_subcategory))],
+            MAIN_PHOTO: [MessageHandler(filters.PHOTO, lot(lot_main_photo))],
+            ADDITIONAL_PHOTO: [MessageHandler(filters.PHOTO, lot(lot_additional_photo)), CommandHandler("skip", lot(lot_skip_additional_photo))],
+            DESCRIPTION: [MessageHandler(filters.TEXT & ~filters.COMMAND, lot(lot_description))],
+            PRICE: [MessageHandler(filters.TEXT & ~filters.COMMAND, lot(lot_price))],
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, instrument(lot_timeout, "conv_add_lot"))],
         },
-        fallbacks=[CommandHandler("cancel", cancel)],
+        fallbacks=[CommandHandler("cancel", instrument(cancel_lot, "conv_add_lot"))],
+        conversation_timeout=LOT_TIMEOUT,
+        name="conv_add_lot",
+        persistent=persistence is not None,
     )
 
-    application.add_handler(CommandHandler("start", start))
+    register(Gauge("bot_user_cache", "Кэш профилей пользователей", lambda: {
+        (stat,): value for stat, value in users.stats().items()}, ("stat",)))
+    register(Gauge("bot_geocode_cache", "Кэш геокодера", lambda: {
+        ("hits",): geocoder.cache.hits, ("misses",): geocoder.cache.misses}, ("stat",)))
+
+    queue.register("create_lot", functools.partial(create_lot_job, application.bot),
+                   functools.partial(create_lot_failed, application.bot))
+
+    application.job_queue.run_repeating(refresh_job, interval=CATEGORY_TTL, first=0)
+
+    application.add_handler(CommandHandler("start", instrument(start)))
     application.add_handler(conv_reg)
     application.add_handler(conv_add_lot)
     application.add_error_handler(error_handler)
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    return application
+
+
+# Главная функция
+def main() -> None:
+    """Run the bot."""
+    # Create the Application and pass it your bot's token.
+    builder = Application.builder().token(os.getenv("TOKEN")).post_init(post_init).post_stop(post_stop).post_shutdown(post_shutdown)
+    if BOT_MODE == "webhook":
+        # Обновления приходят во встроенный сервер, Updater для polling не нужен
+        builder.updater(None)
+    application = build_application(builder)
+    if BOT_MODE == "webhook":
+        asyncio.run(run_webhook(application))
+    else:
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 
 if __name__ == "__main__":
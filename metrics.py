@@ -0,0 +1,200 @@
+import functools
+import logging
+import os
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from aiohttp import web
+from telegram.ext import ConversationHandler
+
+logger = logging.getLogger(__name__)
+
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "8082"))
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{str(value)}"' for name, value in pairs) + '}'
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *labels, amount=1.0):
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} counter'
+        for labels, value in self._values.items():
+            yield f'{self.name}{_format_labels(self.labels, labels)} {value}'
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # На каждый набор меток: счётчики по корзинам (+Inf последней), сумма
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value, *labels):
+        entry = self._values.get(labels)
+        if entry is None:
+            entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def quantile(self, q, *labels, min_count=1):
+        """Верхняя граница корзины, в которую попадает квантиль q; None, если замеров меньше min_count."""
+        entry = self._values.get(labels)
+        if entry is None:
+            return None
+        counts = entry[0]
+        total = sum(counts)
+        if total < min_count:
+            return None
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            if cumulative >= q * total:
+                return bound
+        return float('inf')
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} histogram'
+        for labels, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                yield f'{self.name}_bucket{_format_labels(self.labels, labels, ("le", le))} {cumulative}'
+            yield f'{self.name}_sum{_format_labels(self.labels, labels)} {total}'
+            yield f'{self.name}_count{_format_labels(self.labels, labels)} {cumulative}'
+
+
+class Gauge:
+    """Значение снимается функцией в момент запроса /metrics."""
+
+    def __init__(self, name, help_text, collect, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.collect = collect
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} gauge'
+        for labels, value in self.collect().items():
+            yield f'{self.name}{_format_labels(self.labels, labels)} {value}'
+
+
+REGISTRY = []
+
+
+def register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+
+def render():
+    return '\n'.join(line for metric in REGISTRY for line in metric.render()) + '\n'
+
+
+HANDLER_SECONDS = register(Histogram('bot_handler_seconds', 'Время обработки update', ('handler',)))
+HANDLER_ERRORS = register(Counter('bot_handler_errors_total', 'Исключения в обработчиках', ('handler',)))
+OUTBOUND_SECONDS = register(Histogram('bot_outbound_seconds', 'Время внешних вызовов', ('dependency',)))
+OUTBOUND_ERRORS = register(Counter('bot_outbound_errors_total', 'Ошибки внешних вызовов', ('dependency',)))
+STATE_ENTERED = register(Counter('bot_conversation_state_total', 'Переходы в состояние диалога',
+                                 ('conversation', 'state')))
+STATE_DROPOFFS = register(Counter('bot_conversation_dropoff_total', 'Диалоги, брошенные в состоянии',
+                                  ('conversation', 'state')))
+
+
+@contextmanager
+def observe(dependency):
+    """Замер внешнего вызова: S3, Django API, геокодер, скачивание файла, обработка фото."""
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        OUTBOUND_ERRORS.inc(dependency)
+        raise
+    finally:
+        OUTBOUND_SECONDS.observe(time.perf_counter() - started, dependency)
+
+
+# Текущее состояние каждого диалога: (conversation, user_id) -> имя состояния
+_states: dict[tuple[str, int], str] = {}
+
+
+def instrument(handler, conversation=None, states=None):
+    """Оборачивает обработчик: время, ошибки и, для диалогов, переходы между состояниями.
+
+    states — словарь {номер состояния: имя}; если обработчик вернул END, диалог считается
+    завершённым, а вызов с conversation и states=None (cancel, timeout) — брошенным.
+    """
+    name = handler.__name__
+
+    @functools.wraps(handler)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            result = await handler(update, context)
+        except BaseException:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, name)
+        if conversation is not None and update is not None and update.effective_user is not None:
+            key = (conversation, update.effective_user.id)
+            if states is None:
+                state = _states.pop(key, None)
+                if state is not None:
+                    STATE_DROPOFFS.inc(conversation, state)
+            elif result == ConversationHandler.END:
+                _states.pop(key, None)
+            elif result in states and _states.get(key) != states[result]:
+                _states[key] = states[result]
+                STATE_ENTERED.inc(conversation, states[result])
+        return result
+
+    return wrapper
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=render(), content_type='text/plain', charset='utf-8')
+
+
+_runner: web.AppRunner | None = None
+
+
+async def start_server() -> None:
+    global _runner
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    _runner = web.AppRunner(app)
+    await _runner.setup()
+    await web.TCPSite(_runner, METRICS_HOST, METRICS_PORT).start()
+    logger.info("Метрики доступны на %s:%s/metrics", METRICS_HOST, METRICS_PORT)
+
+
+async def stop_server() -> None:
+    global _runner
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
@@ -0,0 +1,312 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+from abc import ABC, abstractmethod
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+PERSISTENCE = os.getenv("PERSISTENCE")
+PERSISTENCE_PATH = os.getenv("PERSISTENCE_PATH", "bot_state.sqlite3")
+DATABASE_URL = os.getenv("DATABASE_URL")
+PERSISTENCE_INTERVAL = float(os.getenv("PERSISTENCE_INTERVAL", "5"))
+FLUSH_DELAY = float(os.getenv("PERSISTENCE_FLUSH_DELAY", "0.5"))
+
+# Пользователи делятся между воркерами по user_id % WORKER_COUNT;
+# воркер загружает и пишет состояние только своей доли
+WORKER_COUNT = int(os.getenv("WORKER_COUNT", "1"))
+WORKER_INDEX = int(os.getenv("WORKER_INDEX", "0"))
+
+
+def shard_of(user_id: int) -> int:
+    return user_id % WORKER_COUNT
+
+
+def owns(user_id: int) -> bool:
+    return shard_of(user_id) == WORKER_INDEX
+
+
+class StateBackend(ABC):
+    """Хранилище user_data и состояний ConversationHandler для одной доли пользователей."""
+
+    @abstractmethod
+    async def acquire_shard(self, shard: int, count: int) -> None:
+        """Гарантирует, что долю обслуживает только этот процесс."""
+
+    @abstractmethod
+    async def load_user_data(self, shard: int, count: int) -> dict[int, dict]:
+        ...
+
+    @abstractmethod
+    async def load_conversations(self, name: str, shard: int, count: int) -> dict[tuple, object]:
+        ...
+
+    @abstractmethod
+    async def write(self, user_data: dict[int, dict | None], conversations: dict[tuple[str, tuple], object]) -> None:
+        """Одна транзакция: None в user_data и состояние None в conversations означают удаление."""
+
+    @abstractmethod
+    async def close(self) -> None:
+        ...
+
+
+class SqliteBackend(StateBackend):
+    """Локальное хранилище для разработки и тестов; один процесс на файл."""
+
+    def __init__(self, path: str = PERSISTENCE_PATH):
+        self.path = path
+        self._db: sqlite3.Connection | None = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.executescript(
+                "CREATE TABLE IF NOT EXISTS bot_user_data (user_id INTEGER PRIMARY KEY, data TEXT NOT NULL);"
+                "CREATE TABLE IF NOT EXISTS bot_conversations ("
+                " name TEXT NOT NULL, key TEXT NOT NULL, user_id INTEGER NOT NULL, state TEXT NOT NULL,"
+                " PRIMARY KEY (name, key));"
+            )
+        return self._db
+
+    async def acquire_shard(self, shard: int, count: int) -> None:
+        await asyncio.to_thread(self._connect)
+
+    def _load_user_data(self, shard: int, count: int) -> dict[int, dict]:
+        rows = self._connect().execute(
+            "SELECT user_id, data FROM bot_user_data WHERE user_id % ? = ?", (count, shard)).fetchall()
+        return {user_id: json.loads(data) for user_id, data in rows}
+
+    async def load_user_data(self, shard: int, count: int) -> dict[int, dict]:
+        return await asyncio.to_thread(self._load_user_data, shard, count)
+
+    def _load_conversations(self, name: str, shard: int, count: int) -> dict[tuple, object]:
+        rows = self._connect().execute(
+            "SELECT key, state FROM bot_conversations WHERE name = ? AND user_id % ? = ?",
+            (name, count, shard)).fetchall()
+        return {tuple(json.loads(key)): json.loads(state) for key, state in rows}
+
+    async def load_conversations(self, name: str, shard: int, count: int) -> dict[tuple, object]:
+        return await asyncio.to_thread(self._load_conversations, name, shard, count)
+
+    def _write(self, user_data, conversations) -> None:
+        db = self._connect()
+        with db:
+            for user_id, data in user_data.items():
+                if data is None:
+                    db.execute("DELETE FROM bot_user_data WHERE user_id = ?", (user_id,))
+                else:
+                    db.execute("INSERT OR REPLACE INTO bot_user_data (user_id, data) VALUES (?, ?)",
+                               (user_id, json.dumps(data, ensure_ascii=False)))
+            for (name, key), state in conversations.items():
+                if state is None:
+                    db.execute("DELETE FROM bot_conversations WHERE name = ? AND key = ?", (name, json.dumps(key)))
+                else:
+                    db.execute("INSERT OR REPLACE INTO bot_conversations (name, key, user_id, state) VALUES (?, ?, ?, ?)",
+                               (name, json.dumps(key), key[-1], json.dumps(state)))
+
+    async def write(self, user_data, conversations) -> None:
+        await asyncio.to_thread(self._write, user_data, conversations)
+
+    async def close(self) -> None:
+        if self._db is not None:
+            await asyncio.to_thread(self._db.close)
+            self._db = None
+
+
+class PostgresBackend(StateBackend):
+    """Общее хранилище для нескольких воркеров.
+
+    Долю закрепляет advisory lock на отдельном соединении: второй воркер с тем же
+    WORKER_INDEX не стартует, пока первый жив.
+    """
+
+    LOCK_NAMESPACE = 0x77627800
+
+    def __init__(self, dsn: str | None = DATABASE_URL):
+        self.dsn = dsn
+        self._pool = None
+        self._lock_conn = None
+
+    async def _connect(self):
+        if self._pool is None:
+            import asyncpg
+            self._pool = await asyncpg.create_pool(self.dsn, min_size=1, max_size=4)
+            async with self._pool.acquire() as conn:
+                await conn.execute(
+                    "CREATE TABLE IF NOT EXISTS bot_user_data (user_id BIGINT PRIMARY KEY, data JSONB NOT NULL);"
+                    "CREATE TABLE IF NOT EXISTS bot_conversations ("
+                    " name TEXT NOT NULL, key TEXT NOT NULL, user_id BIGINT NOT NULL, state JSONB NOT NULL,"
+                    " PRIMARY KEY (name, key));"
+                )
+        return self._pool
+
+    async def acquire_shard(self, shard: int, count: int) -> None:
+        pool = await self._connect()
+        self._lock_conn = await pool.acquire()
+        locked = await self._lock_conn.fetchval("SELECT pg_try_advisory_lock($1, $2)", self.LOCK_NAMESPACE, shard)
+        if not locked:
+            await pool.release(self._lock_conn)
+            self._lock_conn = None
+            raise RuntimeError(f"Доля {shard}/{count} уже обслуживается другим воркером")
+
+    async def load_user_data(self, shard: int, count: int) -> dict[int, dict]:
+        pool = await self._connect()
+        rows = await pool.fetch("SELECT user_id, data FROM bot_user_data WHERE user_id % $1 = $2", count, shard)
+        return {row['user_id']: json.loads(row['data']) for row in rows}
+
+    async def load_conversations(self, name: str, shard: int, count: int) -> dict[tuple, object]:
+        pool = await self._connect()
+        rows = await pool.fetch(
+            "SELECT key, state FROM bot_conversations WHERE name = $1 AND user_id % $2 = $3", name, count, shard)
+        return {tuple(json.loads(row['key'])): json.loads(row['state']) for row in rows}
+
+    async def write(self, user_data, conversations) -> None:
+        pool = await self._connect()
+        async with pool.acquire() as conn, conn.transaction():
+            deleted_users = [user_id for user_id, data in user_data.items() if data is None]
+            if deleted_users:
+                await conn.execute("DELETE FROM bot_user_data WHERE user_id = ANY($1)", deleted_users)
+            saved_users = [(user_id, json.dumps(data, ensure_ascii=False))
+                           for user_id, data in user_data.items() if data is not None]
+            if saved_users:
+                await conn.executemany(
+                    "INSERT INTO bot_user_data (user_id, data) VALUES ($1, $2::jsonb) "
+                    "ON CONFLICT (user_id) DO UPDATE SET data = EXCLUDED.data", saved_users)
+            for (name, key), state in conversations.items():
+                if state is None:
+                    await conn.execute("DELETE FROM bot_conversations WHERE name = $1 AND key = $2",
+                                       name, json.dumps(key))
+            saved_states = [(name, json.dumps(key), key[-1], json.dumps(state))
+                            for (name, key), state in conversations.items() if state is not None]
+            if saved_states:
+                await conn.executemany(
+                    "INSERT INTO bot_conversations (name, key, user_id, state) VALUES ($1, $2, $3, $4::jsonb) "
+                    "ON CONFLICT (name, key) DO UPDATE SET state = EXCLUDED.state", saved_states)
+
+    async def close(self) -> None:
+        if self._pool is not None:
+            if self._lock_conn is not None:
+                await self._pool.release(self._lock_conn)
+                self._lock_conn = None
+            await self._pool.close()
+            self._pool = None
+
+
+class BotPersistence(BasePersistence):
+    """Сохраняет user_data и состояния диалогов этого воркера.
+
+    Изменения копятся в памяти и пишутся одной транзакцией через FLUSH_DELAY после
+    первого изменения; Application дополнительно сбрасывает их каждые PERSISTENCE_INTERVAL.
+    """
+
+    def __init__(self, backend: StateBackend, shard: int = WORKER_INDEX, count: int = WORKER_COUNT,
+                 update_interval: float = PERSISTENCE_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.backend = backend
+        self.shard = shard
+        self.count = count
+        self._acquired = False
+        self._pending_users: dict[int, dict | None] = {}
+        self._pending_conversations: dict[tuple[str, tuple], object] = {}
+        self._flush_task: asyncio.Task | None = None
+        self._write_lock = asyncio.Lock()
+
+    async def _ensure_shard(self) -> None:
+        if not self._acquired:
+            await self.backend.acquire_shard(self.shard, self.count)
+            self._acquired = True
+
+    def _schedule_flush(self) -> None:
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self) -> None:
+        await asyncio.sleep(FLUSH_DELAY)
+        try:
+            await self._write_pending()
+        except Exception as e:
+            logger.error("Не удалось сохранить состояние: %s", e)
+
+    async def _write_pending(self) -> None:
+        async with self._write_lock:
+            users, self._pending_users = self._pending_users, {}
+            conversations, self._pending_conversations = self._pending_conversations, {}
+            if not users and not conversations:
+                return
+            try:
+                await self.backend.write(users, conversations)
+            except Exception:
+                # Возвращаем несохранённое, не затирая более новые изменения
+                self._pending_users = {**users, **self._pending_users}
+                self._pending_conversations = {**conversations, **self._pending_conversations}
+                raise
+
+    async def get_user_data(self) -> dict[int, dict]:
+        await self._ensure_shard()
+        return await self.backend.load_user_data(self.shard, self.count)
+
+    async def get_chat_data(self) -> dict[int, dict]:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        await self._ensure_shard()
+        return await self.backend.load_conversations(name, self.shard, self.count)
+
+    async def update_conversation(self, name: str, key: tuple, new_state: object | None) -> None:
+        self._pending_conversations[(name, key)] = new_state
+        self._schedule_flush()
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        self._pending_users[user_id] = data
+        self._schedule_flush()
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._pending_users[user_id] = None
+        self._schedule_flush()
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    async def flush(self) -> None:
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self._write_pending()
+        await self.backend.close()
+
+
+def create_persistence() -> BotPersistence | None:
+    if PERSISTENCE == "postgres":
+        return BotPersistence(PostgresBackend())
+    if PERSISTENCE == "sqlite":
+        return BotPersistence(SqliteBackend())
+    return None
@@ -0,0 +1,62 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+PHOTO_INDEX_PATH = os.getenv("PHOTO_INDEX_PATH", "photo_index.sqlite3")
+
+
+class PhotoIndex:
+    """Локальный индекс фото, уже лежащих в S3 и привязанных к созданным лотам.
+
+    Ключ — SHA-256 содержимого исходного файла; дополнительно хранится соответствие
+    file_unique_id Telegram → хэш, чтобы повторное фото можно было узнать без скачивания.
+    Методы блокирующие, вызываются из потока.
+    """
+
+    def __init__(self, path: str = PHOTO_INDEX_PATH):
+        self.path = path
+        self._db: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.executescript(
+                "CREATE TABLE IF NOT EXISTS photos (hash TEXT PRIMARY KEY, renditions TEXT NOT NULL);"
+                "CREATE TABLE IF NOT EXISTS photo_files (file_unique_id TEXT PRIMARY KEY, hash TEXT NOT NULL);"
+            )
+        return self._db
+
+    def find_file(self, file_unique_id: str) -> str | None:
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT hash FROM photo_files WHERE file_unique_id = ?", (file_unique_id,)).fetchone()
+        return row[0] if row else None
+
+    def get(self, content_hash: str) -> dict | None:
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT renditions FROM photos WHERE hash = ?", (content_hash,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def add(self, content_hash: str, renditions: dict, file_unique_ids=()) -> None:
+        with self._lock:
+            db = self._connect()
+            with db:
+                db.execute("INSERT OR IGNORE INTO photos (hash, renditions) VALUES (?, ?)",
+                           (content_hash, json.dumps(renditions)))
+                db.executemany("INSERT OR REPLACE INTO photo_files (file_unique_id, hash) VALUES (?, ?)",
+                               [(file_unique_id, content_hash) for file_unique_id in file_unique_ids])
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+index = PhotoIndex()
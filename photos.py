@@ -0,0 +1,341 @@
+import asyncio
+import functools
+import hashlib
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import httpx
+from telegram.error import TelegramError
+
+import api
+from metrics import observe
+from photo_index import index
+from resilience import background
+from storage import uploader
+
+logger = logging.getLogger(__name__)
+
+# Pillow отпускает GIL при декодировании, масштабировании и кодировании,
+# поэтому пула потоков достаточно, чтобы не блокировать event loop
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv("IMAGE_WORKERS", str(os.cpu_count() or 2))),
+                               thread_name_prefix='image')
+# Размеры фото: имя, ширина, высота, бюджет в байтах
+RENDITIONS = (
+    ('full', 800, 600, int(os.getenv("PHOTO_FULL_BUDGET", "120000"))),
+    ('card', 480, 360, int(os.getenv("PHOTO_CARD_BUDGET", "45000"))),
+    ('thumb', 200, 150, int(os.getenv("PHOTO_THUMB_BUDGET", "12000"))),
+)
+FORMATS = {'JPEG': ('jpg', 'image/jpeg'), 'WEBP': ('webp', 'image/webp')}
+PHOTO_FORMAT = os.getenv("PHOTO_FORMAT", "JPEG").upper()
+if PHOTO_FORMAT not in FORMATS:
+    # Иначе каждое фото падало бы уже при загрузке в S3
+    raise ValueError(f"PHOTO_FORMAT={PHOTO_FORMAT!r} не поддерживается, допустимо: {', '.join(FORMATS)}")
+MAX_QUALITY = 85
+MIN_QUALITY = 40
+# Фоновые загрузки по пользователям: задачи живут только в памяти процесса,
+# в user_data хранится лишь список file_id. Ссылка на файл содержит токен бота
+# и со временем истекает, поэтому она берётся через getFile перед скачиванием
+_uploads: dict[int, dict[str, asyncio.Task]] = {}
+# Дедупликация по SHA-256 содержимого. Пока лот не создан, фото учитываются здесь
+# со счётчиком ссылок: общий объект в S3 удаляется, только когда он не нужен никому
+_inflight: dict[str, asyncio.Task] = {}
+# Сколько вызовов store_photo сейчас ждут загрузку по хэшу
+_waiting: dict[str, int] = {}
+_pending: dict[str, list] = {}
+_hash_by_url: dict[str, str] = {}
+_file_hashes: dict[str, str] = {}
+
+
+def _encode(image, output_format, budget):
+    """Кодирует с максимальным качеством, при котором файл укладывается в budget байт."""
+    def save(quality):
+        output = BytesIO()
+        image.save(output, format=output_format, quality=quality, optimize=True)
+        return output.getvalue()
+
+    data = save(MAX_QUALITY)
+    if len(data) <= budget:
+        return data
+    best, low, high = None, MIN_QUALITY, MAX_QUALITY - 1
+    while low <= high:
+        quality = (low + high) // 2
+        candidate = save(quality)
+        if len(candidate) <= budget:
+            best, low = candidate, quality + 1
+        else:
+            high = quality - 1
+    return best if best is not None else save(MIN_QUALITY)
+
+
+def make_renditions(content, output_format=PHOTO_FORMAT, renditions=RENDITIONS):
+    """Все размеры фото за одно декодирование: {имя: байты}.
+
+    JPEG декодируется сразу в уменьшенном масштабе (draft), ориентация берётся из EXIF,
+    метаданные в результат не переносятся. Каждый следующий размер получается из
+    предыдущего, а не из оригинала.
+    """
+    # Pillow загружается при первой обработке фото, а не при старте бота
+    from PIL import Image, ImageOps
+
+    try:
+        image = Image.open(BytesIO(content))
+        largest = max(max(width, height) for _, width, height, _ in renditions)
+        # Квадратная рамка: после поворота по EXIF стороны могут поменяться местами
+        image.draft('RGB', (largest, largest))
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGB')
+        result = {}
+        for name, width, height, budget in sorted(renditions, key=lambda r: r[1] * r[2], reverse=True):
+            image.thumbnail((width, height), reducing_gap=2.0)
+            result[name] = _encode(image, output_format, budget)
+        return result
+    except Exception as e:
+        logger.info("Ошибка при обработке изображения: %s", e)
+        return None
+
+
+async def _render_and_upload(bucket_name, content_hash, content):
+    loop = asyncio.get_running_loop()
+    try:
+        with observe('resize'):
+            images = await loop.run_in_executor(_executor, make_renditions, content)
+        if images is None:
+            logger.error(f'Ошибка при обработке изображения {content_hash}')
+            return None
+        extension, content_type = FORMATS[PHOTO_FORMAT]
+        names = list(images)
+        results = await asyncio.gather(
+            *(uploader.upload(bucket_name, f'{content_hash}_{name}.{extension}', images[name], content_type)
+              for name in names),
+            return_exceptions=True)
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            logger.error(f'Ошибка при загрузке файла {content_hash} в ведро {bucket_name}: {errors[0]}')
+            await uploader.delete(bucket_name, [result for result in results if isinstance(result, str)])
+            return None
+        logger.info(f'Файл успешно загружен как {content_hash} в ведро {bucket_name}')
+        renditions = dict(zip(names, results))
+        # Запись появляется до снятия задачи из _inflight, чтобы следующий дубль её нашёл
+        _pending.setdefault(content_hash, [renditions, 0, set()])
+        _hash_by_url[renditions['full']] = content_hash
+        return renditions
+    finally:
+        _inflight.pop(content_hash, None)
+
+
+async def _lookup(content_hash):
+    entry = _pending.get(content_hash)
+    if entry is not None:
+        return entry[0]
+    return await asyncio.to_thread(index.get, content_hash)
+
+
+def _hash_of(url):
+    """Хэш содержимого из имени объекта в S3: {хэш}_{размер}.{расширение}."""
+    return url.rsplit('/', 1)[-1].split('_', 1)[0]
+
+
+def _acquire(content_hash, renditions, file_unique_id):
+    entry = _pending.setdefault(content_hash, [renditions, 0, set()])
+    entry[1] += 1
+    if file_unique_id:
+        entry[2].add(file_unique_id)
+        _file_hashes[file_unique_id] = content_hash
+    _hash_by_url[renditions['full']] = content_hash
+    return renditions
+
+
+async def _process_photo(bot, bucket_name, file_id, user_id, file_unique_id=None):
+    # Это фото уже встречалось: берём готовые URL, не скачивая файл
+    if file_unique_id:
+        content_hash = _file_hashes.get(file_unique_id) or await asyncio.to_thread(index.find_file, file_unique_id)
+        if content_hash:
+            renditions = await _lookup(content_hash)
+            if renditions is not None:
+                logger.info(f'Фото {file_unique_id} пользователя {user_id} уже загружено как {content_hash}')
+                return _acquire(content_hash, renditions, file_unique_id)
+    try:
+        photo_file = await bot.get_file(file_id)
+        response = await api.get(photo_file.file_path, dependency='telegram_file')
+    except (TelegramError, httpx.HTTPError) as e:
+        logger.error(f'Ошибка при загрузке изображения {file_id}: {e}')
+        return None
+    if response.status_code != 200:
+        logger.error(f'Ошибка при загрузке изображения {file_id}: {response.status_code}')
+        return None
+    return await store_photo(bucket_name, response.content, file_unique_id)
+
+
+async def store_photo(bucket_name, content, file_unique_id=None):
+    """Сжимает и загружает фото из памяти, если такого содержимого ещё нет в S3.
+
+    Возвращает {размер: URL} или None; результат нужно передать в commit_photos или delete_photos.
+    """
+    content_hash = hashlib.sha256(content).hexdigest()
+    renditions = await _lookup(content_hash)
+    if renditions is None:
+        task = _inflight.get(content_hash)
+        if task is None:
+            task = _inflight[content_hash] = background(_render_and_upload(bucket_name, content_hash, content))
+        _waiting[content_hash] = _waiting.get(content_hash, 0) + 1
+        try:
+            renditions = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            # Загрузка общая и продолжается; если после неё фото не понадобится никому, её удалят
+            task.add_done_callback(functools.partial(_drop_orphan, bucket_name, content_hash))
+            raise
+        finally:
+            _waiting[content_hash] -= 1
+            if not _waiting[content_hash]:
+                del _waiting[content_hash]
+        if renditions is None:
+            return None
+    return _acquire(content_hash, renditions, file_unique_id)
+
+
+def restore_photos(photos):
+    """Учитывает фото незавершённой задачи после перезапуска.
+
+    Счётчики ссылок живут в памяти; без восстановления провал одной задачи удалил бы
+    объекты, общие с другой, ещё ожидающей выполнения.
+    """
+    for photo in photos:
+        _acquire(_hash_of(photo['full']), photo, None)
+
+
+def _drop_orphan(bucket_name, content_hash, task):
+    """Удаляет загруженное фото, если все, кто его ждал, отменились и ссылок на него нет."""
+    if task.cancelled() or task.exception() is not None or task.result() is None:
+        return
+    entry = _pending.get(content_hash)
+    if entry is None or entry[1] > 0 or _waiting.get(content_hash):
+        return
+    # Запись снимается сразу, чтобы её не подхватил новый дубль, пока идёт удаление
+    del _pending[content_hash]
+    _hash_by_url.pop(entry[0]['full'], None)
+    background(_delete_released(bucket_name, [(content_hash, entry)]))
+
+
+def _start_task(bot, bucket_name, file_id, user_id, file_unique_id=None):
+    # Загрузка переживает обработчик, поэтому его срок на неё не распространяется
+    return background(_process_photo(bot, bucket_name, file_id, user_id, file_unique_id))
+
+
+async def _gather_uploads(tasks):
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    uploaded_photos = []
+    for result in results:
+        if isinstance(result, BaseException):
+            logger.error(f'Произошла ошибка: {result}')
+        elif result:
+            uploaded_photos.append(result)
+    return uploaded_photos
+
+
+async def _discard_tasks(bucket_name, tasks):
+    photos = []
+    for task in tasks:
+        if not task.done():
+            task.cancel()
+        elif not task.cancelled() and task.exception() is None and task.result():
+            photos.append(task.result())
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await delete_photos(bucket_name, photos)
+
+
+def start_photo_upload(bot, bucket_name, file_id, user_id, file_unique_id=None):
+    """Запускает обработку фото в фоне сразу после получения.
+
+    Результат задачи — {размер: URL в S3} или None.
+    """
+    tasks = _uploads.setdefault(user_id, {})
+    if file_id not in tasks:
+        tasks[file_id] = _start_task(bot, bucket_name, file_id, user_id, file_unique_id)
+    return tasks[file_id]
+
+
+async def collect_photo_uploads(bot, bucket_name, file_ids, user_id):
+    """Дожидается незавершённых загрузок и возвращает фото ({размер: URL}) в исходном порядке.
+
+    Фото, для которых задачи нет (например, после перезапуска бота), загружаются сейчас.
+    Каждое возвращённое фото нужно передать в commit_photos или delete_photos.
+    """
+    tasks = _uploads.pop(user_id, {})
+    await _discard_tasks(bucket_name, [task for file_id, task in tasks.items() if file_id not in file_ids])
+    return await _gather_uploads([tasks.get(file_id) or _start_task(bot, bucket_name, file_id, user_id)
+                                  for file_id in file_ids])
+
+
+def transfer_photo_uploads(user_id, key):
+    """Передаёт незавершённые загрузки пользователя под другой ключ, например фоновой задаче.
+
+    Пользователь может сразу начать новый лот, не задевая загрузки предыдущего.
+    """
+    tasks = _uploads.pop(user_id, None)
+    if tasks:
+        _uploads[key] = tasks
+
+
+async def discard_photo_uploads(bucket_name, user_id):
+    """Отменяет незавершённые загрузки пользователя и удаляет из S3 уже загруженные фото."""
+    await _discard_tasks(bucket_name, list(_uploads.pop(user_id, {}).values()))
+
+
+def _release(photos):
+    released = []
+    for photo in photos:
+        content_hash = _hash_by_url.get(photo['full'])
+        if content_hash is None:
+            # Фото загружено до перезапуска: счётчика нет, хэш берём из имени объекта.
+            # Если тот же файл сейчас ждут другие, объект остаётся им
+            content_hash = _hash_of(photo['full'])
+            if content_hash not in _pending:
+                released.append((content_hash, [photo, 0, set()]))
+            continue
+        entry = _pending.get(content_hash)
+        if entry is None:
+            continue
+        entry[1] -= 1
+        if entry[1] <= 0:
+            del _pending[content_hash]
+            del _hash_by_url[photo['full']]
+            released.append((content_hash, entry))
+    return released
+
+
+def _forget_files(content_hash, file_unique_ids):
+    for file_unique_id in file_unique_ids:
+        if _file_hashes.get(file_unique_id) == content_hash:
+            del _file_hashes[file_unique_id]
+
+
+async def commit_photos(photos):
+    """Фото попали в созданный лот: запоминаем их в индексе для повторного использования."""
+    for content_hash, (renditions, _, file_unique_ids) in _release(photos):
+        await asyncio.to_thread(index.add, content_hash, renditions, file_unique_ids)
+        # Дальше фото находится по индексу, в памяти его держать незачем
+        _forget_files(content_hash, file_unique_ids)
+
+
+async def delete_photos(bucket_name, photos):
+    """Удаляет из S3 фото, которые больше никому не нужны.
+
+    Фото из индекса и фото, ещё ожидающие отправки у других пользователей, остаются.
+    """
+    await _delete_released(bucket_name, _release(photos))
+
+
+async def _delete_released(bucket_name, released):
+    urls = []
+    for content_hash, (renditions, _, file_unique_ids) in released:
+        _forget_files(content_hash, file_unique_ids)
+        if await asyncio.to_thread(index.get, content_hash) is None:
+            urls.extend(renditions.values())
+    await uploader.delete(bucket_name, urls)
+
+
+async def upload_photos_to_s3(bot, bucket_name, file_ids, user_id):
+    """Скачивает, сжимает и загружает все фото параллельно, сохраняя исходный порядок."""
+    return await _gather_uploads([_start_task(bot, bucket_name, file_id, user_id) for file_id in file_ids])
@@ -0,0 +1,223 @@
+"""Тексты сообщений и клавиатуры бота по языкам.
+
+Каталог собирается один раз при импорте: разметка MarkdownV2 и HTML проверяется
+заранее, и ошибка в шаблоне останавливает запуск, а не приводит к отказу Telegram
+и повторной отправке. Сообщения и клавиатуры неизменяемы и общие для всех update;
+подставляемые значения экранируются под разметку сообщения.
+
+    await update.message.reply_text(**message('lot.name', user_locale(update)))
+"""
+import html
+import os
+from dataclasses import dataclass
+from html.parser import HTMLParser
+from string import Formatter
+from types import MappingProxyType
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardRemove, Update
+from telegram.constants import ParseMode
+from telegram.helpers import escape_markdown
+
+DEFAULT_LOCALE = os.getenv("BOT_LOCALE", "ru")
+
+# Символы, которые в MarkdownV2 вне разметки нужно экранировать обратной чертой
+MARKDOWN_RESERVED = frozenset('_*[]()~`>#+-=|{}.!\\')
+_MARKDOWN_ENTITIES = ('__', '||', '*', '_', '~')
+HTML_TAGS = frozenset(('b', 'strong', 'i', 'em', 'u', 'ins', 's', 'strike', 'del', 'code', 'pre', 'tg-spoiler'))
+
+_ESCAPE = {
+    ParseMode.MARKDOWN_V2: lambda value: escape_markdown(value, version=2),
+    ParseMode.HTML: html.escape,
+}
+
+
+def check_markdown(text: str) -> None:
+    """Проверяет, что зарезервированные символы экранированы, а жирный, курсив и прочие
+    сущности закрыты. Ссылки и код в шаблонах не используются и считаются ошибкой."""
+    opened = []
+    position = 0
+    while position < len(text):
+        char = text[position]
+        if char == '\\':
+            if position + 1 == len(text) or text[position + 1] not in MARKDOWN_RESERVED:
+                raise ValueError(f"лишняя обратная черта в позиции {position}")
+            position += 2
+            continue
+        entity = next((item for item in _MARKDOWN_ENTITIES if text.startswith(item, position)), None)
+        if entity is not None:
+            if opened and opened[-1] == entity:
+                opened.pop()
+            elif entity in opened:
+                raise ValueError(f"сущность {entity!r} в позиции {position} пересекается с другой")
+            else:
+                opened.append(entity)
+            position += len(entity)
+            continue
+        if char in MARKDOWN_RESERVED:
+            raise ValueError(f"неэкранированный символ {char!r} в позиции {position}")
+        position += 1
+    if opened:
+        raise ValueError(f"не закрыта сущность {opened[-1]!r}")
+
+
+class _HTMLChecker(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.opened = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag not in HTML_TAGS:
+            raise ValueError(f"тег <{tag}> не поддерживается Telegram")
+        self.opened.append(tag)
+
+    def handle_endtag(self, tag):
+        if not self.opened or self.opened.pop() != tag:
+            raise ValueError(f"лишний закрывающий тег </{tag}>")
+
+
+def check_html(text: str) -> None:
+    checker = _HTMLChecker()
+    checker.feed(text)
+    checker.close()
+    if checker.opened:
+        raise ValueError(f"не закрыт тег <{checker.opened[-1]}>")
+
+
+@dataclass(frozen=True, slots=True)
+class Prompt:
+    """Шаблон сообщения: text с полями str.format, разметка и клавиатура по умолчанию."""
+    text: str
+    parse_mode: str | None = None
+    reply_markup: InlineKeyboardMarkup | ReplyKeyboardRemove | None = None
+    fields: tuple[str, ...] = ()
+
+    def render(self, **values) -> str:
+        if not self.fields:
+            return self.text
+        escape = _ESCAPE.get(self.parse_mode, str)
+        return self.text.format(**{name: escape(str(value)) for name, value in values.items()})
+
+
+def _prompt(text: str, parse_mode: str | None = None, reply_markup=None) -> Prompt:
+    parsed = list(Formatter().parse(text))
+    fields = tuple(name for _, name, _, _ in parsed if name is not None)
+    # Разметку проверяем без полей: значения экранируются при подстановке
+    literal = ''.join(literal for literal, _, _, _ in parsed)
+    if parse_mode == ParseMode.MARKDOWN_V2:
+        check_markdown(literal)
+    elif parse_mode == ParseMode.HTML:
+        check_html(literal)
+    return Prompt(text, parse_mode, reply_markup, fields)
+
+
+def markdown(text: str, reply_markup=None) -> Prompt:
+    return _prompt(text, ParseMode.MARKDOWN_V2, reply_markup)
+
+
+def html_text(text: str, reply_markup=None) -> Prompt:
+    return _prompt(text, ParseMode.HTML, reply_markup)
+
+
+def plain(text: str, reply_markup=None) -> Prompt:
+    return _prompt(text, None, reply_markup)
+
+
+def _ru() -> dict[str, Prompt]:
+    cancel = "Отменить заполнение, нажмите /cancel"
+    remove_keyboard = ReplyKeyboardRemove()
+    reg_keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("✏️ Редактировать", callback_data="edit_reg")],
+        [InlineKeyboardButton("🚪 Выход", callback_data="exit_reg")]
+    ])
+    working_time_keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("⏱ с 8.00 до 22.00", callback_data="time_one")],
+        [InlineKeyboardButton("⏱ с 10.00 до 21.00", callback_data="time_two")],
+    ])
+    return {
+        'start': plain(
+            "Привет, {first_name}! Добро пожаловать на площадку объявлений WBX. "
+            "Нажмите на кнопку 'Пуск' в левом нижнем углу, чтобы познакомиться с объявлениями!"),
+        'unavailable': plain("Сервис временно недоступен. Попробуйте позже."),
+        'closed': plain("Форма закрыта...", remove_keyboard),
+
+        'lot.no_username': plain(
+            "У вас нет @username(ссылки), что бы открывать чат с вами. Зайдите \"Настройки\", \"Имя пользователя\", "
+            "придумайте имя пользователя, после установки это сообщение больше не появится."),
+        'lot.name': markdown(f"🔎 *Название*\n\n{cancel}"),
+        'lot.name_invalid': plain(f"Неверный формат. Ввод от 10 до 80 символов. Повторите ввод.\n\n{cancel}"),
+        'lot.api_error': plain(f"Ошибка при запросе к API. Повторите попытку.\n\n{cancel}"),
+        # Клавиатуры категорий строит categories при обновлении справочника
+        'lot.category': markdown(f"📕 *Категория*\n\n{cancel}"),
+        'lot.category_not_found': plain("Категория не найдена. Повторите выбор."),
+        'lot.subcategory': markdown(f"📗 *Подкатегория*\n\n{cancel}"),
+        'lot.subcategory_not_found': plain("Подкатегория не найдена. Повторите выбор."),
+        'lot.main_photo': markdown(f"🖼 *Главное фото*\n\n{cancel}", remove_keyboard),
+        'lot.additional_photos': html_text(
+            "🖼 <b>Дополнительные фото (4 шт)</b>\n"
+            "Пропустить добавление фото и перейти к описанию, нажмите /skip\n"
+            f"{cancel}"),
+        'lot.more_photos': markdown(
+            "🖼 *Еще {count} допфото*\n\n"
+            "Пропустить добавление фото, нажмите /skip\n\n"
+            f"{cancel}"),
+        'lot.description': markdown(f"📝 *Описание*\n{cancel}"),
+        'lot.description_invalid': plain(
+            f"Не верный формат ввода.Формат от 50 до 500 знаков. Повторите ввод.\n\n{cancel}"),
+        'lot.price': markdown(f"💵 *Стоимость*\n\n{cancel}"),
+        'lot.price_invalid': plain("Не верный формат цены. Повторите ввод."),
+        'lot.accepted': plain("Лот принят! Мы сообщим, когда он будет опубликован."),
+        'lot.created': plain("Ваш лот добавлен!"),
+        'lot.failed': plain("Не удалось добавить лот «{name}». Попробуйте позже."),
+
+        'reg.profile': plain(
+            "Регион: {region}\n"
+            "Адрес: {address}\n"
+            "Время работы: с {start} до {end} \n",
+            reg_keyboard),
+        'reg.edit_unavailable': plain("Пока не доступно!"),
+        'reg.location': markdown("📍 *Геопозиция*\n\nДля отмены нажмите /cancel"),
+        'reg.location_invalid': plain(
+            "Что то пошло не так. Попробуйте выбрать геометку еще раз.\n\nДля отмены нажмите /cancel"),
+        'reg.working_time': markdown("⌛️ *Время работы*\n\nДля отмены нажмите /cancel", working_time_keyboard),
+        'reg.api_error': plain("Ошибка при запросе к API. Повторите попытку."),
+        'reg.request_error': plain("Request error. Error: {error}"),
+        'reg.done': plain("Отлично! Теперь можно добавлять объявления!"),
+    }
+
+
+def _build(catalogues: dict) -> MappingProxyType:
+    if DEFAULT_LOCALE not in catalogues:
+        raise ValueError(f"Нет текстов для BOT_LOCALE={DEFAULT_LOCALE!r}")
+    keys = catalogues[DEFAULT_LOCALE].keys()
+    for name, prompts in catalogues.items():
+        missing = keys - prompts.keys()
+        if missing:
+            raise ValueError(f"В текстах {name!r} нет {', '.join(sorted(missing))}")
+    return MappingProxyType({name: MappingProxyType(prompts) for name, prompts in catalogues.items()})
+
+
+CATALOGUES = _build({'ru': _ru()})
+
+
+def user_locale(update: Update) -> str:
+    """Язык из настроек Telegram пользователя, если для него есть тексты, иначе BOT_LOCALE."""
+    user = update.effective_user
+    code = (user.language_code or '').split('-')[0] if user is not None else ''
+    return code if code in CATALOGUES else DEFAULT_LOCALE
+
+
+def get(key: str, locale: str | None = None) -> Prompt:
+    return CATALOGUES.get(locale, CATALOGUES[DEFAULT_LOCALE])[key]
+
+
+def message(key: str, locale: str | None = None, **values) -> dict:
+    """Аргументы text, parse_mode и reply_markup для reply_text, send_message и edit_message_text.
+
+    reply_markup попадает в словарь, только если у шаблона есть своя клавиатура, чтобы
+    вызывающий мог передать динамическую.
+    """
+    prompt = get(key, locale)
+    kwargs = {'text': prompt.render(**values), 'parse_mode': prompt.parse_mode}
+    if prompt.reply_markup is not None:
+        kwargs['reply_markup'] = prompt.reply_markup
+    return kwargs
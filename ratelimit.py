@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from metrics import Gauge, Histogram, register
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Bot API: около 30 сообщений в секунду на бота и порядка одного в секунду на чат.
+# Общий лимит чуть ниже: разброс сетевых задержек сбивает запросы в пачки на стороне Telegram
+TG_RATE = float(os.getenv("TG_RATE", "28"))
+TG_BURST = int(os.getenv("TG_BURST", "1"))
+TG_CHAT_RATE = float(os.getenv("TG_CHAT_RATE", "1"))
+TG_CHAT_BURST = int(os.getenv("TG_CHAT_BURST", "3"))
+TG_GROUP_RATE = 20 / 60
+TG_MAX_RETRIES = int(os.getenv("TG_MAX_RETRIES", "3"))
+# Сколько вызовов может ждать токен одновременно; остальные ждут своей очереди на входе
+RATE_LIMIT_QUEUE = int(os.getenv("RATE_LIMIT_QUEUE", "1000"))
+MAX_KEYS = 10000
+
+WAIT_SECONDS = register(Histogram('bot_rate_limit_wait_seconds', 'Время ожидания в очереди ограничителя',
+                                  ('limiter',), buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)))
+
+_limiters: dict[str, 'RateLimiter'] = {}
+
+
+class TokenBucket:
+    """Ведро токенов с резервированием: токены уходят в минус, и каждый следующий
+    вызов ждёт дольше предыдущего, так что очередь обслуживается по порядку."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+
+    def reserve(self) -> float:
+        """Забирает токен и возвращает, сколько секунд ждать, пока он станет доступен."""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        self._tokens -= 1
+        return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+    def refund(self) -> None:
+        """Возвращает токен отменённого вызова, чтобы он не задерживал остальных."""
+        if self.rate > 0:
+            self._tokens = min(self.burst, self._tokens + 1)
+
+    @property
+    def idle(self) -> bool:
+        return self.rate <= 0 or self._tokens + (time.monotonic() - self._updated) * self.rate >= self.burst
+
+    async def acquire(self) -> None:
+        delay = self.reserve()
+        if delay:
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                self.refund()
+                raise
+
+
+class RateLimiter:
+    """Общее ведро и вёдра по ключу (чат, эндпоинт) с ограниченной очередью.
+
+    Вызов сначала ждёт токен своего ключа, затем общий, чтобы долгое ожидание в одном
+    чате не занимало общую пропускную способность. Когда очередь заполнена, новые
+    вызовы не падают, а ждут места в ней. rate <= 0 отключает соответствующее ведро.
+    """
+
+    def __init__(self, name: str, rate: float, burst: int = 1, key_rate: float = 0, key_burst: int = 1,
+                 queue_size: int = RATE_LIMIT_QUEUE):
+        self.name = name
+        self.key_rate = key_rate
+        self.key_burst = key_burst
+        self.queue_size = queue_size
+        self.bucket = TokenBucket(rate, burst)
+        self._keys: OrderedDict = OrderedDict()
+        self._slots: asyncio.Semaphore | None = None
+        self.waiting = 0
+
+    def _key_bucket(self, key, rate: float | None = None) -> TokenBucket:
+        bucket = self._keys.get(key)
+        if bucket is None:
+            if len(self._keys) >= MAX_KEYS:
+                # Сбрасываем вёдра, которые уже наполнились: их состояние ничего не ограничивает
+                for old_key in [old_key for old_key, old in self._keys.items() if old.idle]:
+                    del self._keys[old_key]
+                while len(self._keys) >= MAX_KEYS:
+                    self._keys.popitem(last=False)
+            bucket = self._keys[key] = TokenBucket(self.key_rate if rate is None else rate, self.key_burst)
+        else:
+            self._keys.move_to_end(key)
+        return bucket
+
+    async def acquire(self, key=None, rate: float | None = None) -> None:
+        """Ждёт разрешения на вызов; rate переопределяет лимит для нового ключа."""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.queue_size)
+        started = time.perf_counter()
+        self.waiting += 1
+        try:
+            async with self._slots:
+                if key is not None and (self.key_rate > 0 or rate):
+                    await self._key_bucket(key, rate).acquire()
+                await self.bucket.acquire()
+        finally:
+            self.waiting -= 1
+            WAIT_SECONDS.observe(time.perf_counter() - started, self.name)
+
+
+def limiter(name: str, rate: float, burst: int = 1, key_rate: float = 0, key_burst: int = 1) -> RateLimiter:
+    """Ограничитель внешней зависимости по имени из metrics.observe; создаётся один раз на процесс."""
+    if name not in _limiters:
+        _limiters[name] = RateLimiter(name, rate, burst, key_rate, key_burst)
+    return _limiters[name]
+
+
+def get_limiter(name: str) -> RateLimiter | None:
+    return _limiters.get(name)
+
+
+register(Gauge('bot_rate_limit_waiting', 'Вызовы, ожидающие в очереди ограничителя',
+               lambda: {(name,): item.waiting for name, item in _limiters.items()}, ('limiter',)))
+
+
+class TelegramRateLimiter(BaseRateLimiter):
+    """Ограничитель исходящих запросов Bot API для Application.builder().rate_limiter().
+
+    Запросы с chat_id проходят через общее ведро бота и ведро чата (для групп и каналов
+    лимит строже); остальные методы не ограничиваются. На RetryAfter все запросы
+    приостанавливаются на указанное Telegram время, и запрос повторяется.
+    """
+
+    def __init__(self, max_retries: int = TG_MAX_RETRIES):
+        self.max_retries = max_retries
+        self.limiter = limiter('telegram', TG_RATE, TG_BURST, TG_CHAT_RATE, TG_CHAT_BURST)
+        self._resume = asyncio.Event()
+        self._resume.set()
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get('chat_id')
+        max_retries = self.max_retries if rate_limit_args is None else rate_limit_args
+        attempt = 0
+        while True:
+            await self._resume.wait()
+            if chat_id is not None:
+                group = isinstance(chat_id, str) or int(chat_id) < 0
+                await self.limiter.acquire(chat_id, TG_GROUP_RATE if group else None)
+                # Пока ждали токен, Telegram мог попросить паузу: после неё встаём в очередь заново
+                if not self._resume.is_set():
+                    continue
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                attempt += 1
+                if attempt > max_retries:
+                    raise
+                logger.warning("Flood control на %s, пауза %s с (попытка %s)", endpoint, e.retry_after, attempt)
+                if self._resume.is_set():
+                    self._resume.clear()
+                    try:
+                        await asyncio.sleep(float(e.retry_after) + 0.1)
+                    finally:
+                        self._resume.set()
+                else:
+                    await self._resume.wait()
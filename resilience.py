@@ -0,0 +1,146 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+import httpx
+
+from metrics import Counter, Gauge, register
+
+logger = logging.getLogger(__name__)
+
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_RESET = float(os.getenv("BREAKER_RESET", "30"))
+HANDLER_DEADLINE = float(os.getenv("HANDLER_DEADLINE", "10"))
+
+CLOSED, HALF_OPEN, OPEN = 'closed', 'half_open', 'open'
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+BREAKER_REJECTED = register(Counter('bot_circuit_rejected_total', 'Запросы, не отправленные из-за разомкнутой цепи',
+                                    ('dependency',)))
+HEDGED = register(Counter('bot_hedged_requests_total', 'Дублирующие запросы к медленной зависимости',
+                          ('dependency',)))
+
+_deadline: contextvars.ContextVar[float | None] = contextvars.ContextVar('deadline', default=None)
+_breakers: dict[str, 'CircuitBreaker'] = {}
+
+
+class CircuitOpenError(httpx.TransportError):
+    """Зависимость считается недоступной, запрос не отправлялся."""
+
+
+class DeadlineExceeded(httpx.TimeoutException):
+    """Истекло время, отведённое на обработку update."""
+
+
+class CircuitBreaker:
+    """Размыкатель цепи для одной зависимости.
+
+    После failures ошибок подряд (сеть, таймауты, 5xx) запросы сразу отклоняются
+    CircuitOpenError. Через reset_timeout пропускается один пробный запрос: успех
+    замыкает цепь, ошибка снова размыкает её.
+    """
+
+    def __init__(self, name: str, failures: int = BREAKER_FAILURES, reset_timeout: float = BREAKER_RESET):
+        self.name = name
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self._failed = 0
+        self._opened_at = 0.0
+        self._trial = False
+
+    def allow(self) -> None:
+        if self.state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self.state = HALF_OPEN
+            self._trial = False
+        if self.state == OPEN or (self.state == HALF_OPEN and self._trial):
+            BREAKER_REJECTED.inc(self.name)
+            raise CircuitOpenError(f"{self.name} временно недоступен")
+        if self.state == HALF_OPEN:
+            self._trial = True
+
+    def success(self) -> None:
+        if self.state != CLOSED:
+            logger.info("Цепь %s замкнута", self.name)
+        self.state = CLOSED
+        self._failed = 0
+        self._trial = False
+
+    def failure(self) -> None:
+        self._failed += 1
+        if self.state == HALF_OPEN or self._failed >= self.failures:
+            if self.state != OPEN:
+                logger.warning("Цепь %s разомкнута на %s с после %s ошибок", self.name, self.reset_timeout, self._failed)
+            self.state = OPEN
+            self._opened_at = time.monotonic()
+            self._trial = False
+
+    def release(self) -> None:
+        """Пробный запрос отменён, не дав результата: следующий сможет попробовать снова."""
+        if self.state == HALF_OPEN:
+            self._trial = False
+
+
+def breaker(name: str) -> CircuitBreaker:
+    if name not in _breakers:
+        _breakers[name] = CircuitBreaker(name)
+    return _breakers[name]
+
+
+register(Gauge('bot_circuit_state', 'Состояние цепи зависимости: 0 — замкнута, 1 — пробный запрос, 2 — разомкнута',
+               lambda: {(name,): _STATE_VALUES[item.state] for name, item in _breakers.items()}, ('dependency',)))
+
+
+def remaining() -> float | None:
+    """Сколько секунд осталось до срока текущей обработки; None, если срока нет."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+@contextmanager
+def deadline(seconds: float):
+    """Срок для всех внешних вызовов внутри блока; вложенный срок не может быть позже внешнего."""
+    current = _deadline.get()
+    new = time.monotonic() + seconds
+    token = _deadline.set(new if current is None else min(current, new))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def with_deadline(handler, seconds: float = HANDLER_DEADLINE):
+    """Оборачивает обработчик: его запросы к API и геокодеру укладываются в seconds."""
+
+    @functools.wraps(handler)
+    async def wrapper(update, context):
+        with deadline(seconds):
+            return await handler(update, context)
+
+    return wrapper
+
+
+def background(coro) -> asyncio.Task:
+    """Задача без срока вызывающего: общую или фоновую работу не должен обрывать чужой срок."""
+    context = contextvars.copy_context()
+    context.run(_deadline.set, None)
+    task = asyncio.create_task(coro, context=context)
+    # Все ожидавшие могли уйти по своему сроку: ошибку некому забрать, и asyncio жаловался бы в лог
+    task.add_done_callback(lambda done: done.cancelled() or done.exception())
+    return task
+
+
+async def wait_shared(task: asyncio.Task):
+    """Ждёт общую задачу в пределах своего срока, не отменяя её для остальных."""
+    left = remaining()
+    try:
+        async with asyncio.timeout(left):
+            return await asyncio.shield(task)
+    except TimeoutError:
+        if left is None:
+            raise
+        raise DeadlineExceeded("Истёк срок ожидания ответа") from None
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from metrics import observe
+
+logger = logging.getLogger(__name__)
+
+S3_ENDPOINT = os.getenv('S3_ENDPOINT', 'https://s3.timeweb.cloud')
+S3_CONCURRENCY = int(os.getenv('S3_CONCURRENCY', '16'))
+S3_RETRIES = int(os.getenv('S3_RETRIES', '3'))
+S3_BACKOFF = 0.2
+CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+class S3Uploader:
+    """Долгоживущий загрузчик в S3: один клиент с пулом соединений на процесс.
+
+    Одновременно выполняется не больше concurrency загрузок; неудачные повторяются
+    с экспоненциальной задержкой и случайным разбросом. Ключи уникальны, поэтому
+    объекты помечаются как неизменяемые для кэшей.
+    """
+
+    def __init__(self, endpoint: str = S3_ENDPOINT, concurrency: int = S3_CONCURRENCY, retries: int = S3_RETRIES):
+        self.endpoint = endpoint
+        self.concurrency = concurrency
+        self.retries = retries
+        self._client = None
+        self._client_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='s3')
+        self._semaphore: asyncio.Semaphore | None = None
+        self._transfer = None
+
+    @property
+    def client(self):
+        with self._client_lock:
+            if self._client is None:
+                # boto3 тяжёлый при импорте: загружаем его, только когда клиент действительно нужен
+                import boto3
+                from boto3.s3.transfer import TransferConfig
+                from botocore.config import Config
+
+                # Файлы больше порога уходят multipart-загрузкой в несколько потоков
+                self._transfer = TransferConfig(multipart_threshold=8 * 1024 * 1024, max_concurrency=4)
+                self._client = boto3.client(
+                    's3',
+                    endpoint_url=self.endpoint,
+                    aws_access_key_id=os.getenv('ACCESS_KEY'),
+                    aws_secret_access_key=os.getenv('SECRET_ACCESS_KEY'),
+                    config=Config(
+                        max_pool_connections=self.concurrency,
+                        connect_timeout=5,
+                        read_timeout=30,
+                        tcp_keepalive=True,
+                        # Повторы делаем сами, с разбросом задержки
+                        retries={'total_max_attempts': 1},
+                    ),
+                )
+        return self._client
+
+    async def start(self) -> None:
+        """Создаёт клиент заранее, чтобы первая загрузка не платила за разбор конфигурации и TLS."""
+        await asyncio.to_thread(lambda: self.client)
+
+    def url(self, bucket_name: str, key: str) -> str:
+        return f'{self.endpoint}/{bucket_name}/{key}'
+
+    def key(self, bucket_name: str, url: str) -> str | None:
+        prefix = f'{self.endpoint}/{bucket_name}/'
+        return url[len(prefix):] if url.startswith(prefix) else None
+
+    def _put(self, bucket_name: str, key: str, data: bytes, content_type: str) -> None:
+        self.client.upload_fileobj(
+            BytesIO(data), bucket_name, key,
+            ExtraArgs={'ContentType': content_type, 'CacheControl': CACHE_CONTROL},
+            Config=self._transfer,
+        )
+
+    def _delete(self, bucket_name: str, keys: list[str]) -> None:
+        for key in keys:
+            try:
+                self.client.delete_object(Bucket=bucket_name, Key=key)
+                logger.info(f'Файл {key} удален из ведра {bucket_name}')
+            except Exception as e:
+                logger.error(f'Ошибка при удалении файла {bucket_name}/{key}: {e}')
+
+    async def upload(self, bucket_name: str, key: str, data: bytes, content_type: str = 'image/jpeg') -> str:
+        """Загружает объект и возвращает его URL.
+
+        Если задачу отменили во время загрузки, поток не прервать — объект удаляется,
+        как только допишется.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        loop = asyncio.get_running_loop()
+        attempt = 0
+        async with self._semaphore:
+            while True:
+                attempt += 1
+                future = loop.run_in_executor(self._executor, self._put, bucket_name, key, data, content_type)
+                try:
+                    with observe('s3_upload'):
+                        await asyncio.shield(future)
+                    return self.url(bucket_name, key)
+                except asyncio.CancelledError:
+                    def cleanup(done):
+                        if not done.cancelled() and done.exception() is None:
+                            loop.run_in_executor(self._executor, self._delete, bucket_name, [key])
+                    future.add_done_callback(cleanup)
+                    raise
+                except Exception as e:
+                    if attempt > self.retries:
+                        raise
+                    logger.warning(f'Ошибка загрузки {bucket_name}/{key} (попытка {attempt}): {e}')
+                await asyncio.sleep(random.uniform(0, S3_BACKOFF * 2 ** attempt))
+
+    async def delete(self, bucket_name: str, urls: list[str]) -> None:
+        keys = [key for key in (self.key(bucket_name, url) for url in urls) if key]
+        if keys:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._delete, bucket_name, keys)
+
+
+uploader = S3Uploader()
@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+
+import httpx
+
+import api
+from resilience import background, wait_shared
+
+logger = logging.getLogger(__name__)
+
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "60"))
+USER_CACHE_NEGATIVE_TTL = int(os.getenv("USER_CACHE_NEGATIVE_TTL", "15"))
+
+
+class UserCache:
+    """LRU+TTL кэш записей api/user/{id}/.
+
+    404 тоже кэшируется (на меньший срок) и возвращается как None. Одновременные
+    запросы одного пользователя ждут общий запрос к бэкенду. Если бэкенд недоступен,
+    отдаётся устаревшая запись, пока её не вытеснили из кэша.
+    """
+
+    def __init__(self, maxsize: int = USER_CACHE_SIZE, ttl: int = USER_CACHE_TTL,
+                 negative_ttl: int = USER_CACHE_NEGATIVE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries: OrderedDict[int, tuple[float, dict | None]] = OrderedDict()
+        self._inflight: dict[int, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+        self.evictions = 0
+        self.stale = 0
+
+    def _store(self, user_id: int, data: dict | None) -> None:
+        ttl = self.ttl if data is not None else self.negative_ttl
+        self._entries[user_id] = (time.monotonic() + ttl, data)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def _fetch(self, user_id: int) -> dict | None:
+        current = asyncio.current_task()
+        try:
+            response = await api.get(f"api/user/{user_id}/", hedge=True)
+            if response.status_code == 404:
+                data = None
+            else:
+                response.raise_for_status()
+                data = response.json()
+            # Если запись инвалидировали во время запроса, ответ мог устареть — не кэшируем его
+            if self._inflight.get(user_id) is current:
+                self._store(user_id, data)
+            return data
+        finally:
+            if self._inflight.get(user_id) is current:
+                del self._inflight[user_id]
+
+    async def get(self, user_id: int) -> dict | None:
+        """Запись пользователя или None, если он не зарегистрирован. Ошибки API пробрасываются."""
+        entry = self._entries.get(user_id)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+        task = self._inflight.get(user_id)
+        if task is None:
+            self.misses += 1
+            task = self._inflight[user_id] = background(self._fetch(user_id))
+        else:
+            self.shared += 1
+        try:
+            # Отмена одного ожидающего не должна обрывать общий запрос
+            return await wait_shared(task)
+        except (httpx.HTTPError, ValueError) as e:
+            if entry is None:
+                raise
+            logger.warning("Бэкенд недоступен, отдаём устаревшую запись пользователя %s: %s", user_id, e)
+            self.stale += 1
+            return entry[1]
+
+    def invalidate(self, user_id: int) -> None:
+        self._entries.pop(user_id, None)
+        self._inflight.pop(user_id, None)
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'shared': self.shared,
+            'evictions': self.evictions,
+            'stale': self.stale,
+        }
+
+
+users = UserCache()
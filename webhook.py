@@ -0,0 +1,122 @@
+import asyncio
+import hmac
+import json
+import logging
+import os
+import signal
+
+import httpx
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+
+import api
+from persistence import owns, shard_of
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8081"))
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", "10"))
+# Сверх этого числа необработанных обновлений Telegram получает 503 и доставит их позже
+WEBHOOK_MAX_QUEUE = int(os.getenv("WEBHOOK_MAX_QUEUE", "5000"))
+# Базовые URL воркеров по порядку WORKER_INDEX, через запятую
+WORKER_PEERS = [peer for peer in os.getenv("WORKER_PEERS", "").split(",") if peer]
+
+APPLICATION_KEY = web.AppKey("application", Application)
+
+
+async def handle_update(request: web.Request) -> web.Response:
+    # Без секрета любой, кто узнал URL, мог бы присылать обновления от имени пользователей
+    if not WEBHOOK_SECRET or not hmac.compare_digest(
+            request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), WEBHOOK_SECRET):
+        return web.Response(status=403)
+    application = request.app[APPLICATION_KEY]
+    body = await request.read()
+    try:
+        update = Update.de_json(json.loads(body), application.bot)
+    except ValueError:
+        return web.Response(status=400)
+    user = update.effective_user
+    if user is not None and not owns(user.id):
+        return await forward_update(body, shard_of(user.id))
+    if application.update_queue.qsize() >= WEBHOOK_MAX_QUEUE:
+        return web.Response(status=503)
+    # Отвечаем сразу: Telegram ждёт 200, обработка идёт в очереди приложения
+    await application.update_queue.put(update)
+    return web.Response()
+
+
+async def forward_update(body: bytes, shard: int) -> web.Response:
+    """Передаёт обновление воркеру, который владеет состоянием пользователя.
+
+    У каждого воркера своя цепь: недоступный воркер не отсекает обновления для остальных.
+    """
+    headers = {"Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": WEBHOOK_SECRET}
+    try:
+        response = await api.request("POST", WORKER_PEERS[shard].rstrip('/') + WEBHOOK_PATH,
+                                     content=body, headers=headers, dependency=f'worker_peer_{shard}')
+    except (IndexError, httpx.HTTPError) as e:
+        logger.error("Не удалось передать обновление воркеру %s: %s", shard, e)
+        return web.Response(status=502)
+    # Ошибка воркера возвращается Telegram, чтобы тот повторил доставку
+    return web.Response(status=200 if response.status_code == 200 else 502)
+
+
+async def handle_health(request: web.Request) -> web.Response:
+    if request.app[APPLICATION_KEY].running:
+        return web.json_response({"status": "ok"})
+    return web.json_response({"status": "stopping"}, status=503)
+
+
+def create_app(application: Application) -> web.Application:
+    app = web.Application()
+    app[APPLICATION_KEY] = application
+    app.router.add_post(WEBHOOK_PATH, handle_update)
+    app.router.add_get("/health", handle_health)
+    return app
+
+
+async def run_webhook(application: Application) -> None:
+    """Запуск бота на встроенном aiohttp-сервере вместо long polling.
+
+    Останавливается по SIGINT/SIGTERM: сервер перестаёт принимать запросы,
+    дожидается текущих и только затем останавливает приложение.
+    Без WEBHOOK_SECRET не запускается.
+    """
+    if not WEBHOOK_SECRET:
+        raise RuntimeError("Для режима webhook нужен WEBHOOK_SECRET")
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    runner = web.AppRunner(create_app(application), shutdown_timeout=SHUTDOWN_TIMEOUT)
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        await runner.setup()
+        await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+        logger.info("Webhook слушает %s:%s%s", WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH)
+        if WEBHOOK_URL:
+            await application.bot.set_webhook(
+                url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=Update.ALL_TYPES,
+            )
+        await stop.wait()
+    finally:
+        logger.info("Остановка webhook-сервера")
+        await runner.cleanup()
+        if application.running:
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)